@@ -1,18 +1,29 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import random
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession
 from datetime import date, datetime, timedelta
 import urllib.parse
 import time
 import io
 import os 
-from PIL import Image, ImageDraw, ImageFont
-import base64
 import requests
+import requests.adapters
 import json
-# Removed unused import: google.oauth2
+import re
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+try: from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+except ImportError: from streamlit.runtime.scriptrunner.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+from gspread.utils import absolute_range_name, numericise_all, rowcol_to_a1
+# Import budget on a cold start (python -X importtime): pandas ~0.5 s, streamlit ~0.45 s, gspread ~0.3 s,
+# all needed by every page. PIL (receipts), base64 (photo upload) and altair (owner chart, ~0.25 s)
+# are imported where they are used so the public booking page does not pay for them.
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(page_title="Barbershop Keren System", page_icon="💈", layout="wide")
@@ -48,6 +59,7 @@ except:
 
 # --- UPLOAD FUNCTION ---
 def upload_ke_drive(file_buffer, nama_file_simpan):
+    import base64
     try:
         string_gambar = base64.b64encode(file_buffer.getvalue()).decode('utf-8')
         payload = {"filename": nama_file_simpan, "image": string_gambar}
@@ -113,31 +125,401 @@ if 'nota_terakhir' not in st.session_state:
     st.session_state['nota_terakhir'] = None
 
 # --- DATABASE CONNECTION FUNCTION (HYBRID AUTH) ---
+# One authorized client and one Spreadsheet per process. The AuthorizedSession keeps
+# HTTPS connections alive and refreshes the access token by itself, and all worksheet
+# handles come from a single metadata fetch.
+NAMA_SPREADSHEET = 'TRIPL3_Barbershop_DB'
+
 @st.cache_resource
-def get_google_sheet(sheet_name):
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+def get_spreadsheet():
+    scope = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+    
+    # PRIORITY 1: Check for Secrets (Cloud Production)
+    if "gcp_service_account" in st.secrets:
+        creds = Credentials.from_service_account_info(dict(st.secrets["gcp_service_account"]), scopes=scope)
+    # PRIORITY 2: Check Local File (Local Development)
+    else:
+        creds = Credentials.from_service_account_file('credentials.json', scopes=scope)
     
+    session = AuthorizedSession(creds)
+    session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=2))
+    client = gspread.authorize(creds, session=session)
+    client.set_timeout((5, 30))  # (connect, read) seconds, so a hung call cannot pin a worker thread
+    
+    # Opening by key skips the Drive search that open() does by title
+    spreadsheet_id = st.secrets.get("sheets", {}).get("spreadsheet_id")
+    spreadsheet = client.open_by_key(spreadsheet_id) if spreadsheet_id else client.open(NAMA_SPREADSHEET)
+    worksheets = {ws.title: ws for ws in spreadsheet.worksheets()}
+    return spreadsheet, worksheets
+
+def get_google_sheet(sheet_name):
     try:
-        # PRIORITY 1: Check for Secrets (Cloud Production)
-        if "gcp_service_account" in st.secrets:
-            creds_dict = dict(st.secrets["gcp_service_account"])
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        # PRIORITY 2: Check Local File (Local Development)
-        else:
-            creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
-            
-        client = gspread.authorize(creds)
-        return client.open('TRIPL3_Barbershop_DB').worksheet(sheet_name)
+        spreadsheet, worksheets = get_spreadsheet()
+        if sheet_name not in worksheets: worksheets[sheet_name] = spreadsheet.worksheet(sheet_name)
+        return worksheets[sheet_name]
     except Exception as e:
         st.error(f"Koneksi Database Gagal: {e}")
         st.stop()
 
+# --- VERSIONED CACHE REGISTRY ---
+# One version counter per worksheet. A write bumps only the sheet it touched, and
+# cached readers key on the versions of the sheets they read, so a booking no longer
+# throws away the service list (or anything else) for every open session.
+SHEET_DB = ['Booking', 'Pemasukan', 'Pengeluaran', 'Pelanggan', 'Layanan', 'Config', 'Pomade']
+
+class CacheRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.versi = {s: 0 for s in SHEET_DB}
+        self.hit = {s: 0 for s in SHEET_DB}; self.miss = {s: 0 for s in SHEET_DB}
+        self.hasil = {}  # (fungsi, args) -> (versi sheet, nilai); only the latest version is kept
+
+    def bump(self, sheet_name):
+        with self.lock: self.versi[sheet_name] = self.versi.get(sheet_name, 0) + 1
+
+    def versi_dari(self, sheets):
+        with self.lock: return tuple(self.versi.get(s, 0) for s in sheets)
+
+    def catat(self, sheets, is_hit):
+        with self.lock:
+            for s in sheets:
+                target = self.hit if is_hit else self.miss
+                target[s] = target.get(s, 0) + 1
+
+    def statistik(self):
+        with self.lock:
+            rows = []
+            for s in self.versi:
+                total = self.hit.get(s, 0) + self.miss.get(s, 0)
+                rate = f"{self.hit.get(s, 0) / total:.0%}" if total else "-"
+                rows.append({'Sheet': s, 'Versi': self.versi[s], 'Hit': self.hit.get(s, 0), 'Miss': self.miss.get(s, 0), 'Hit Rate': rate})
+            return pd.DataFrame(rows)
+
+@st.cache_resource
+def get_cache_registry():
+    return CacheRegistry()
+
+def cache_per_sheet(*sheets):
+    # Memoize a reader on the versions of the worksheets it reads. Results are shared
+    # between sessions, so callers must treat them as read-only.
+    def decorator(fungsi):
+        @functools.wraps(fungsi)
+        def wrapper(*args):
+            for s in sheets:
+                try: get_sheet_mirror(s).sinkron(catat=False)
+                except Exception: pass  # The reader's own error handling deals with a dead connection
+            reg = get_cache_registry()
+            versi = reg.versi_dari(sheets); key = (fungsi.__name__, args)
+            with reg.lock: simpanan = reg.hasil.get(key)
+            if simpanan and simpanan[0] == versi:
+                reg.catat(sheets, True); return simpanan[1]
+            reg.catat(sheets, False)
+            nilai = fungsi(*args)
+            with reg.lock: reg.hasil[key] = (versi, nilai)
+            return nilai
+        return wrapper
+    return decorator
+
+def tandai_sheet_berubah(sheet_name):
+    # Call after appending rows: bumps the sheet version and makes its mirror fetch the new rows
+    get_cache_registry().bump(sheet_name)
+    get_sheet_mirror(sheet_name).tandai_append()
+
+# --- WORKSHEET MIRROR (READ-THROUGH CACHE) ---
+# Each worksheet is downloaded once per process. After that only the rows appended
+# below the last known row are fetched, and writes from this app patch the mirror
+# directly, so a rerun normally costs zero or one small API call instead of a full read.
+MIRROR_SYNC_DETIK = 15      # Minimum gap between two "new rows?" checks
+MIRROR_RELOAD_DETIK = 600   # Full reload to pick up manual edits made in the sheet
+
+class SheetMirror:
+    def __init__(self, sheet_name):
+        self.sheet_name = sheet_name
+        self.lock = threading.RLock()
+        self.header = []; self.rows = []
+        self.df = pd.DataFrame()
+        self.versi = 0; self.generasi = 0  # generasi only moves on a full reload
+        self.waktu_sync = 0.0; self.waktu_reload = 0.0
+        self.perlu_reload = True; self.perlu_sync = False
+
+    def _rapikan(self, row):
+        # Same cell typing as get_all_records(): pad to header width, numeric strings -> numbers
+        row = list(row[:len(self.header)]) + [''] * (len(self.header) - len(row))
+        return numericise_all(row)
+
+    def _bangun_df(self):
+        self.df = pd.DataFrame(self.rows, columns=self.header) if self.header else pd.DataFrame()
+        self.versi += 1
+        get_cache_registry().bump(self.sheet_name)
+
+    def rencana_sync(self):
+        # What this mirror still needs: ('penuh', range), ('ekor', range) or (None, None) when fresh
+        now = time.monotonic()
+        if self.perlu_reload or not self.header or now - self.waktu_reload > MIRROR_RELOAD_DETIK:
+            return 'penuh', absolute_range_name(self.sheet_name)
+        if self.perlu_sync or now - self.waktu_sync > MIRROR_SYNC_DETIK:
+            # Sheet row of the first unknown record = header (1) + known rows + 1
+            kolom_akhir = rowcol_to_a1(1, len(self.header))[:-1]
+            return 'ekor', absolute_range_name(self.sheet_name, f"A{len(self.rows) + 2}:{kolom_akhir}")
+        return None, None
+
+    def terima(self, mode, values, jumlah_baris_rencana):
+        # Apply values fetched for a plan made earlier (possibly in a batch with other sheets)
+        with self.lock:
+            if mode == 'penuh':
+                # A blank row 1 comes back as [] from values_batch_get: pad it to the widest row, as
+                # get_all_values() does, so cells by row/column number are never cut off
+                lebar = max((len(r) for r in values), default=0)
+                self.header = [str(h).strip() for h in values[0]] + [''] * (lebar - len(values[0])) if values else []
+                self.rows = [self._rapikan(r) for r in values[1:]]
+                self.generasi += 1
+                self._bangun_df()
+                self.waktu_reload = self.waktu_sync = time.monotonic()
+                self.perlu_reload = False; self.perlu_sync = False
+            elif mode == 'ekor':
+                if jumlah_baris_rencana != len(self.rows) or self.perlu_reload: return  # Mirror moved on meanwhile
+                baru = [r for r in values if any(str(v).strip() for v in r)]
+                if baru:
+                    self.rows.extend(self._rapikan(r) for r in baru)
+                    self._bangun_df()
+                self.waktu_sync = time.monotonic(); self.perlu_sync = False
+
+    def sinkron(self, catat=True):
+        with self.lock:
+            mode, rng = self.rencana_sync()
+            get_cache_registry().catat([self.sheet_name] if catat else [], mode is None)
+            if mode is None: return self.versi
+            try:
+                sheet = get_google_sheet(self.sheet_name)
+                values = sheet.get_all_values() if mode == 'penuh' else sheet.get(rng)
+                self.terima(mode, values, len(self.rows))
+            except Exception as e:
+                # Serve the last good copy if there is one; a cold mirror has nothing to fall back to
+                if not self.header: raise
+                print(f"Mirror {self.sheet_name} gagal sync: {e}")
+            return self.versi
+
+    def snapshot(self):
+        with self.lock: return self.df.copy()
+
+    def get_df(self):
+        with self.lock:
+            self.sinkron()
+            return self.df.copy()
+
+    def patch_sel(self, baris_sheet, kolom, nilai):
+        # Mirror an update_cell() locally (sheet row/col are 1-based, row 1 = header)
+        with self.lock:
+            i = baris_sheet - 2
+            if self.perlu_reload or not (0 <= i < len(self.rows)) or not (1 <= kolom <= len(self.header)):
+                self.perlu_reload = True; return
+            nilai = numericise_all([str(nilai)])[0]
+            self.rows[i][kolom - 1] = nilai
+            try: self.df.iat[i, kolom - 1] = nilai
+            except (TypeError, ValueError):
+                self.df.isetitem(kolom - 1, self.df.iloc[:, kolom - 1].astype(object)); self.df.iat[i, kolom - 1] = nilai
+            self.versi += 1
+            get_cache_registry().bump(self.sheet_name)
+
+    def patch_kolom(self, kolom, nilai_per_baris):
+        # Many patch_sel() calls on one column with a single DataFrame rebuild
+        with self.lock:
+            if self.perlu_reload or not (1 <= kolom <= len(self.header)): self.perlu_reload = True; return
+            for baris_sheet, nilai in nilai_per_baris.items():
+                if 0 <= baris_sheet - 2 < len(self.rows): self.rows[baris_sheet - 2][kolom - 1] = numericise_all([str(nilai)])[0]
+            self._bangun_df()
+
+    def nilai_baris(self, baris_sheet, kolom_list):
+        # Current mirrored values of one sheet row, e.g. to undo a write; blank when unknown
+        with self.lock:
+            i = baris_sheet - 2
+            row = self.rows[i] if 0 <= i < len(self.rows) else []
+            return {k: (row[k - 1] if k - 1 < len(row) else '') for k in kolom_list}
+
+    def tandai_append(self):
+        # Rows were appended by us: fetch them on the next read instead of waiting for the timer
+        with self.lock: self.perlu_sync = True
+
+    def invalidate(self):
+        with self.lock: self.perlu_reload = True
+        get_cache_registry().bump(self.sheet_name)
+
+@st.cache_resource
+def get_sheet_mirror(sheet_name):
+    return SheetMirror(sheet_name)
+
+def baca_sheet(sheet_name):
+    return get_sheet_mirror(sheet_name).get_df()
+
+def baris_dari_append(res):
+    # Sheet row of the first appended row, from an append_row(s) response ('Sheet!A12:E12' -> 12)
+    rentang = (res or {}).get('updates', {}).get('updatedRange', '')
+    cocok = re.search(r'!\$?[A-Z]+\$?(\d+)', rentang)
+    return int(cocok.group(1)) if cocok else None
+
+# --- BATCH READ (ONE ROUND TRIP FOR SEVERAL SHEETS) ---
+def sinkron_batch(sheet_names):
+    # Whatever the mirrors still need (full sheet or just the new tail rows) is fetched in
+    # one values_batch_get request
+    mirrors = {n: get_sheet_mirror(n) for n in sheet_names}
+    rencana = {}
+    for n, m in mirrors.items():
+        with m.lock: rencana[n] = m.rencana_sync() + (len(m.rows),)
+    perlu = [n for n in sheet_names if rencana[n][0]]
+    reg = get_cache_registry()
+    for n in sheet_names: reg.catat([n], n not in perlu)
+    if perlu:
+        try:
+            spreadsheet, _ = get_spreadsheet()
+            hasil = spreadsheet.values_batch_get([rencana[n][1] for n in perlu])
+            for n, value_range in zip(perlu, hasil.get('valueRanges', [])):
+                mirrors[n].terima(rencana[n][0], value_range.get('values', []), rencana[n][2])
+        except Exception as e:
+            if any(not mirrors[n].header for n in perlu): raise
+            print(f"Batch read gagal, pakai data terakhir: {e}")
+    return mirrors
+
+def baca_batch(sheet_names):
+    # sinkron_batch() + {sheet_name: DataFrame}
+    mirrors = sinkron_batch(sheet_names)
+    return {n: mirrors[n].snapshot() for n in sheet_names}
+
+# --- TYPED LOADER ---
+# Per-sheet schema: money columns become int64 (vectorized "Rp 70.000" -> 70000, junk -> 0),
+# dates become datetime64 once, and repeated text becomes categorical. Converted once per
+# sheet version; reports filter on these columns instead of reparsing strings every run.
+SKEMA_SHEET = {
+    'Pemasukan': {'uang': ['Nominal'], 'tanggal': ['Tanggal'], 'kategori': ['Item']},
+    'Pengeluaran': {'uang': ['Nominal'], 'tanggal': ['Tanggal'], 'kategori': ['Item']},
+    'Booking': {'uang': ['Diskon', 'Harga_Final'], 'tanggal': ['Tanggal'], 'kategori': ['Kapster', 'Layanan', 'Status']},
+    'Pomade': {'uang': ['Nominal'], 'tanggal': ['Tanggal'], 'kategori': ['Nama_Pomade']},
+}
+
+def uang_ke_int(seri):
+    # Numeric cells (already numericised by the mirror) convert as they are; only text cells such as
+    # "Rp 70.000" get the currency and thousands separators stripped
+    if pd.api.types.is_numeric_dtype(seri): angka = seri.astype('float64')
+    else:
+        teks = seri.map(type).eq(str)
+        angka = pd.to_numeric(seri.where(~teks), errors='coerce')
+        angka[teks] = pd.to_numeric(seri[teks].str.replace(r'[.,]|Rp', '', regex=True).str.strip(), errors='coerce')
+    return angka.fillna(0).round().astype('int64')
+
+def ketik_df(df, sheet_name):
+    # Apply the sheet's schema to a raw frame (in place) and return it
+    skema = SKEMA_SHEET.get(sheet_name, {})
+    for c in skema.get('uang', []):
+        if c in df.columns: df[c] = uang_ke_int(df[c])
+    for c in skema.get('tanggal', []):
+        if c in df.columns: df[c] = pd.to_datetime(df[c].astype(str), format='%Y-%m-%d', errors='coerce')
+    for c in skema.get('kategori', []):
+        if c in df.columns: df[c] = df[c].astype(str).astype('category')
+    return df
+
+def _buat_pembaca_bertipe(sheet_name):
+    # One memoized reader per sheet, so a new booking does not re-type the ledger
+    def pembaca():
+        df = get_sheet_mirror(sheet_name).snapshot()
+        return ketik_df(df, sheet_name) if not df.empty else df
+    pembaca.__name__ = f"sheet_bertipe_{sheet_name}"
+    return cache_per_sheet(sheet_name)(pembaca)
+
+PEMBACA_BERTIPE = {s: _buat_pembaca_bertipe(s) for s in SKEMA_SHEET}
+
+def baca_bertipe(sheet_name):
+    # Typed copy of a worksheet; callers may modify it
+    return PEMBACA_BERTIPE[sheet_name]().copy()
+
+# --- LEDGER (PEMASUKAN) PARSED VIEW ---
+# Keterangan is "[nota] pelanggan (metode) - kapster" ("[nota] Promo/Diskon - kapster" for a
+# discount line). It is split once per Pemasukan version into real columns; Metode and Kapster
+# are categoricals, so reports and lookups filter on columns instead of rescanning the text.
+POLA_KETERANGAN = r'^\s*\[(?P<Nota_ID>\w+)\]\s*(?P<Pelanggan>.*?)\s*(?:\((?P<Metode>[^()]*)\))?\s*-\s*(?P<Kapster>[^-]*?)\s*$'
+METODE_BAYAR = {'tunai': 'Tunai', 'qris': 'QRIS'}
+
+def urai_keterangan(df):
+    # Add Nota_ID / Pelanggan / Metode / Kapster (in place) to typed Pemasukan rows
+    if df.empty or 'Keterangan' not in df.columns: return df
+    kolom = df['Keterangan'].astype(str).where(df['Keterangan'].notna()).str.extract(POLA_KETERANGAN)
+    kapster_kanon = {k.casefold(): k for k in INFO_KAPSTER}
+    df['Nota_ID'] = kolom['Nota_ID']
+    df['Pelanggan'] = kolom['Pelanggan']
+    metode = kolom['Metode'].str.strip()
+    df['Metode'] = metode.str.casefold().map(METODE_BAYAR).fillna(metode).astype('category')
+    kapster = kolom['Kapster'].str.strip()
+    df['Kapster'] = kapster.str.casefold().map(kapster_kanon).fillna(kapster).astype('category')
+    return df
+
+@cache_per_sheet('Pemasukan')
+def _pemasukan_terurai():
+    return urai_keterangan(baca_bertipe('Pemasukan'))
+
+def baca_pemasukan():
+    # Typed ledger plus Nota_ID / Pelanggan / Metode / Kapster columns; a copy, callers may modify it
+    return _pemasukan_terurai().copy()
+
+# --- CONCURRENT I/O ---
+# Independent fetches (different sheets, Drive, Config) run side by side on a shared
+# pool, so a page waits for the slowest call instead of the sum of all calls.
+IO_TIMEOUT_DETIK = 15
+
+@st.cache_resource
+def get_io_pool():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="sheets-io")
+
+def jalankan_paralel(tugas, timeout=IO_TIMEOUT_DETIK):
+    # tugas = {nama: (fungsi, args, default)}; a call that fails or runs past the timeout yields its default
+    ctx = get_script_run_ctx()
+    def jalankan(fungsi, args):
+        # Lets st.* calls inside workers reach this session; detached afterwards so the next task on this
+        # shared pool thread (another session's, or a background refresh) does not run under it
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try: return fungsi(*args)
+        finally: setattr(threading.current_thread(), SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+    pool = get_io_pool()
+    futures = {nama: pool.submit(jalankan, fungsi, args) for nama, (fungsi, args, _) in tugas.items()}
+    batas = time.monotonic() + timeout
+    hasil = {}
+    for nama, future in futures.items():
+        try: hasil[nama] = future.result(timeout=max(0, batas - time.monotonic()))
+        except Exception as e:
+            print(f"I/O '{nama}' gagal/timeout: {e!r}")
+            hasil[nama] = tugas[nama][2]
+    return hasil
+
 # --- GET SERVICE DATA FUNCTION ---
-@st.cache_data(ttl=600)
+# Parsed once per Layanan version. Lookups go through a normalized name (spacing/case do not
+# matter), upgrade deltas are precomputed for every pair, and `sidik` changes iff the catalog does.
+def normalisasi_layanan(nama):
+    return " ".join(str(nama).split()).casefold()
+
+class ServiceCatalog:
+    def __init__(self, layanan_dict):
+        self.layanan = layanan_dict
+        self.daftar_nama = list(layanan_dict.keys())
+        self.norm = {normalisasi_layanan(n): v for n, v in layanan_dict.items()}
+        self.selisih = {(normalisasi_layanan(a), normalisasi_layanan(b)): vb['Harga'] - va['Harga']
+                        for a, va in layanan_dict.items() for b, vb in layanan_dict.items() if a != b}
+        self.sidik = hash(tuple((n, v['Harga'], v['Durasi']) for n, v in layanan_dict.items()))
+
+    def info(self, nama): return self.norm.get(normalisasi_layanan(nama))
+
+    def harga(self, nama, default=0):
+        item = self.info(nama); return item['Harga'] if item else default
+
+    def durasi(self, nama, default=45):
+        item = self.info(nama); return item['Durasi'] if item else default
+
+    def selisih_upgrade(self, dari, ke):
+        # Unknown starting service counts as price 0, like the old checkout loop
+        return self.selisih.get((normalisasi_layanan(dari), normalisasi_layanan(ke)), self.harga(ke) - self.harga(dari))
+
+KATALOG_DEFAULT = ServiceCatalog({"Triple A (Default)": {'Harga': 70000, 'Durasi': 45, 'Deskripsi': 'Standard'}})
+
+@cache_per_sheet('Layanan')
 def get_daftar_layanan():
     try:
-        sheet = get_google_sheet('Layanan')
-        data = sheet.get_all_records()
+        data = baca_sheet('Layanan').to_dict('records')
         layanan_dict = {}
         for item in data:
             nama = item['Nama_Layanan']
@@ -150,267 +532,484 @@ def get_daftar_layanan():
                 'Durasi': durasi_int, 
                 'Deskripsi': item['Deskripsi']
             }
-        return layanan_dict
+        return ServiceCatalog(layanan_dict)
     except:
-        return {"Triple A (Default)": {'Harga': 70000, 'Durasi': 45, 'Deskripsi': 'Standard'}}
+        return KATALOG_DEFAULT
 
 # --- RECEIPT GENERATION FUNCTION ---
-def generate_receipt_image(nama, list_items, total_normal, diskon_val, harga_final, kapster, tanggal, jam, no_nota):
-    # Setup Canvas
-    tinggi_base = 600
-    tinggi_per_item = 40
-    H = tinggi_base + (len(list_items) * tinggi_per_item)
-    W = 400
-    
-    img = Image.new('RGB', (W, H), color='white')
-    draw = ImageDraw.Draw(img)
-    
-    try:
-        font_title = ImageFont.truetype("arial.ttf", 28)
-        font_bold = ImageFont.truetype("arialbd.ttf", 18)
-        font_reg = ImageFont.truetype("arial.ttf", 16)
-        font_small = ImageFont.truetype("arial.ttf", 14)
-        font_ig = ImageFont.truetype("arialbd.ttf", 16)
-    except:
-        font_title = ImageFont.load_default()
-        font_bold = ImageFont.load_default()
-        font_reg = ImageFont.load_default()
-        font_small = ImageFont.load_default()
-        font_ig = ImageFont.load_default()
-
-    # HEADER LOGO
-    y = 20
-    try:
-        logo_img = Image.open("logo_struk.png") 
-        base_width = 150
-        w_percent = (base_width / float(logo_img.size[0]))
-        h_size = int((float(logo_img.size[1]) * float(w_percent)))
-        logo_img = logo_img.resize((base_width, h_size), Image.Resampling.LANCZOS)
-        
-        img_w, img_h = logo_img.size
-        x_pos = (W - img_w) // 2
-        img.paste(logo_img, (x_pos, y), logo_img if logo_img.mode == 'RGBA' else None)
-        y += img_h + 10 
-    except Exception as e:
-        text_bbox = draw.textbbox((0, 0), "BARBERSHOP KEREN", font=font_title)
-        x_pos = (W - (text_bbox[2] - text_bbox[0])) / 2
-        draw.text((x_pos, y), "BARBERSHOP KEREN", font=font_title, fill='black')
-        y += 40
-
-    # ADDRESS (Indonesian Context)
-    def draw_centered(text, font, y_curr, color='black'):
+# Fonts, the resized logo, the header (logo, address, WA line, separator) and the footer
+# ("Terima Kasih!" + IG icon) are rendered once per process; each receipt only draws the
+# transaction block on a blank canvas and pastes the two templates around it.
+RECEIPT_W = 400
+
+class ReceiptRenderer:
+    def __init__(self):
+        from PIL import Image, ImageDraw, ImageFont
+        W = RECEIPT_W
+        try:
+            self.font_title = ImageFont.truetype("arial.ttf", 28)
+            self.font_bold = ImageFont.truetype("arialbd.ttf", 18)
+            self.font_reg = ImageFont.truetype("arial.ttf", 16)
+            self.font_small = ImageFont.truetype("arial.ttf", 14)
+            self.font_ig = ImageFont.truetype("arialbd.ttf", 16)
+        except:
+            self.font_title = self.font_bold = self.font_reg = self.font_small = self.font_ig = ImageFont.load_default()
+
+        # HEADER TEMPLATE (drawn on a tall strip, cropped to its final height)
+        header = Image.new('RGB', (W, 600), color='white')
+        draw = ImageDraw.Draw(header)
+        y = 20
+        try:
+            logo_img = Image.open("logo_struk.png")
+            base_width = 150
+            w_percent = (base_width / float(logo_img.size[0]))
+            h_size = int((float(logo_img.size[1]) * float(w_percent)))
+            logo_img = logo_img.resize((base_width, h_size), Image.Resampling.LANCZOS)
+            img_w, img_h = logo_img.size
+            header.paste(logo_img, ((W - img_w) // 2, y), logo_img if logo_img.mode == 'RGBA' else None)
+            y += img_h + 10
+        except Exception:
+            text_bbox = draw.textbbox((0, 0), "BARBERSHOP KEREN", font=self.font_title)
+            draw.text(((W - (text_bbox[2] - text_bbox[0])) / 2, y), "BARBERSHOP KEREN", font=self.font_title, fill='black')
+            y += 40
+
+        # ADDRESS (Indonesian Context)
+        y = self._tengah(draw, "Jl. Merdeka No. 10", self.font_small, y) # Change to your address
+        y = self._tengah(draw, "Jakarta Selatan", self.font_small, y)
+        y += 5
+        y = self._tengah(draw, "WA: 0812-XXXX-XXXX", self.font_small, y)
+        y += 10
+        draw.line((20, y, W-20, y), fill='black', width=2)
+        y += 20
+        self.tinggi_header = y
+        self.header = header.crop((0, 0, W, y))
+
+        # FOOTER TEMPLATE: "Terima Kasih!" at its top edge, IG icon 30px below
+        footer = Image.new('RGB', (W, 60), color='white')
+        draw = ImageDraw.Draw(footer)
+        self._tengah(draw, "Terima Kasih!", self.font_bold, 0); y = 30
+        ig_text = "barbershop.keren" # Change to your IG
+        bbox_ig = draw.textbbox((0,0), ig_text, font=self.font_ig)
+        icon_size = 20; gap = 8
+        start_x = (W - (icon_size + gap + bbox_ig[2] - bbox_ig[0])) / 2
+        draw.rounded_rectangle((start_x, y, start_x + icon_size, y + icon_size), radius=5, outline="black", width=2)
+        draw.ellipse((start_x + 5, y + 5, start_x + 15, y + 15), outline="black", width=2)
+        draw.point((start_x + 15, y + 4), fill="black")
+        draw.text((start_x + icon_size + gap, y), ig_text, font=self.font_ig, fill='black')
+        self.footer = footer
+
+    def _tengah(self, draw, text, font, y_curr, color='black'):
         bbox = draw.textbbox((0, 0), text, font=font)
-        w_text = bbox[2] - bbox[0]
-        draw.text(((W - w_text) / 2, y_curr), text, font=font, fill=color)
+        draw.text(((RECEIPT_W - (bbox[2] - bbox[0])) / 2, y_curr), text, font=font, fill=color)
         return y_curr + (bbox[3] - bbox[1]) + 5
 
-    y = draw_centered("Jl. Merdeka No. 10", font_small, y) # Change to your address
-    y = draw_centered("Jakarta Selatan", font_small, y)
-    y += 5
-    y = draw_centered("WA: 0812-XXXX-XXXX", font_small, y)
-    
-    y += 10
-    draw.line((20, y, W-20, y), fill='black', width=2)
-    y += 20
-
-    # TRANSACTION INFO
-    draw.text((30, y), f"No. Nota : {no_nota}", font=font_bold, fill='black'); y += 25
-    draw.text((30, y), f"Tanggal  : {tanggal} {jam}", font=font_reg, fill='black'); y += 25
-    draw.text((30, y), f"Kapster  : {kapster}", font=font_reg, fill='black'); y += 25
-    draw.text((30, y), f"Customer : {nama}", font=font_reg, fill='black'); y += 30
-    draw.line((20, y, W-20, y), fill='grey', width=1); y += 20
-
-    # DETAILS
-    draw.text((30, y), "Rincian:", font=font_bold, fill='black'); y += 25
-    for item in list_items:
-        nama_item = item['nama']
-        if len(nama_item) > 35: nama_item = nama_item[:32] + "..."
-        harga_item_fmt = f"{item['harga']:,}".replace(',', '.')
-        
-        draw.text((30, y), nama_item, font=font_reg, fill='black')
-        price_bbox = draw.textbbox((0,0), harga_item_fmt, font=font_reg)
-        draw.text((W - 30 - (price_bbox[2]-price_bbox[0]), y), harga_item_fmt, font=font_reg, fill='black')
-        y += 30
+    def _kanan(self, draw, text, font, y, color='black'):
+        bbox = draw.textbbox((0,0), text, font=font)
+        draw.text((RECEIPT_W - 30 - (bbox[2]-bbox[0]), y), text, font=font, fill=color)
+
+    def render(self, nama, list_items, total_normal, diskon_val, harga_final, kapster, tanggal, jam, no_nota):
+        from PIL import Image, ImageDraw
+        W = RECEIPT_W; H = 600 + (len(list_items) * 40)
+        img = Image.new('RGB', (W, H), color='white')
+        img.paste(self.header, (0, 0))
+        draw = ImageDraw.Draw(img)
+        y = self.tinggi_header
+
+        # TRANSACTION INFO
+        draw.text((30, y), f"No. Nota : {no_nota}", font=self.font_bold, fill='black'); y += 25
+        draw.text((30, y), f"Tanggal  : {tanggal} {jam}", font=self.font_reg, fill='black'); y += 25
+        draw.text((30, y), f"Kapster  : {kapster}", font=self.font_reg, fill='black'); y += 25
+        draw.text((30, y), f"Customer : {nama}", font=self.font_reg, fill='black'); y += 30
+        draw.line((20, y, W-20, y), fill='grey', width=1); y += 20
+
+        # DETAILS
+        draw.text((30, y), "Rincian:", font=self.font_bold, fill='black'); y += 25
+        for item in list_items:
+            nama_item = item['nama']
+            if len(nama_item) > 35: nama_item = nama_item[:32] + "..."
+            draw.text((30, y), nama_item, font=self.font_reg, fill='black')
+            self._kanan(draw, f"{item['harga']:,}".replace(',', '.'), self.font_reg, y)
+            y += 30
 
-    y += 10
-    draw.line((20, y, W-20, y), fill='black', width=1); y += 15
-    
-    # SUBTOTAL, DISCOUNT, TOTAL
-    draw.text((30, y), "Subtotal", font=font_reg, fill='black')
-    sub_fmt = f"Rp {total_normal:,}".replace(',', '.')
-    sub_bbox = draw.textbbox((0,0), sub_fmt, font=font_reg)
-    draw.text((W - 30 - (sub_bbox[2]-sub_bbox[0]), y), sub_fmt, font=font_reg, fill='black'); y += 25
-
-    if diskon_val > 0:
-        draw.text((30, y), "Diskon", font=font_reg, fill='red')
-        disc_fmt = f"- Rp {diskon_val:,}".replace(',', '.')
-        disc_bbox = draw.textbbox((0,0), disc_fmt, font=font_reg)
-        draw.text((W - 30 - (disc_bbox[2]-disc_bbox[0]), y), disc_fmt, font=font_reg, fill='red'); y += 25
-
-    draw.line((20, y, W-20, y), fill='black', width=2); y += 15
-
-    draw.text((30, y), "TOTAL BAYAR", font=font_title, fill='black')
-    total_fmt = f"Rp {harga_final:,}".replace(',', '.')
-    total_bbox = draw.textbbox((0,0), total_fmt, font=font_title)
-    draw.text((W - 30 - (total_bbox[2]-total_bbox[0]), y), total_fmt, font=font_title, fill='black'); y += 60
-
-    draw_centered("Terima Kasih!", font_bold, y); y += 30
-
-    # IG ICON
-    ig_text = "barbershop.keren" # Change to your IG
-    bbox_ig = draw.textbbox((0,0), ig_text, font=font_ig)
-    w_text_ig = bbox_ig[2] - bbox_ig[0]
-    icon_size = 20
-    gap = 8
-    total_width = icon_size + gap + w_text_ig
-    start_x = (W - total_width) / 2
-    
-    draw.rounded_rectangle((start_x, y, start_x + icon_size, y + icon_size), radius=5, outline="black", width=2)
-    draw.ellipse((start_x + 5, y + 5, start_x + 15, y + 15), outline="black", width=2)
-    draw.point((start_x + 15, y + 4), fill="black")
-    draw.text((start_x + icon_size + gap, y), ig_text, font=font_ig, fill='black')
-    
-    return img
+        y += 10
+        draw.line((20, y, W-20, y), fill='black', width=1); y += 15
+
+        # SUBTOTAL, DISCOUNT, TOTAL
+        draw.text((30, y), "Subtotal", font=self.font_reg, fill='black')
+        self._kanan(draw, f"Rp {total_normal:,}".replace(',', '.'), self.font_reg, y); y += 25
+        if diskon_val > 0:
+            draw.text((30, y), "Diskon", font=self.font_reg, fill='red')
+            self._kanan(draw, f"- Rp {diskon_val:,}".replace(',', '.'), self.font_reg, y, 'red'); y += 25
+        draw.line((20, y, W-20, y), fill='black', width=2); y += 15
+
+        draw.text((30, y), "TOTAL BAYAR", font=self.font_title, fill='black')
+        self._kanan(draw, f"Rp {harga_final:,}".replace(',', '.'), self.font_title, y); y += 60
+
+        img.paste(self.footer, (0, y))
+        return img
+
+@st.cache_resource
+def get_receipt_renderer():
+    return ReceiptRenderer()
+
+def generate_receipt_image(nama, list_items, total_normal, diskon_val, harga_final, kapster, tanggal, jam, no_nota):
+    return get_receipt_renderer().render(nama, list_items, total_normal, diskon_val, harga_final, kapster, tanggal, jam, no_nota)
 
 # --- CHECK TIME FUNCTION ---
-def get_jam_tersedia(tanggal_pilihan, kapster_pilihan, durasi_layanan_baru, semua_layanan_db):
+# Occupancy per (tanggal, kapster): {sheet row: (start, end) in minutes}. Built once from the
+# Booking mirror, then fed only the rows the mirror picked up since; simpan_booking and
+# batalkan_booking update it in place. A slot query never touches the Booking rows.
+JAM_BUKA_MENIT = 10 * 60
+JAM_TUTUP_MENIT = 24 * 60
+SLOT_MENIT = 15
+KALENDER_HARI = 14
+
+class JadwalIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reservasi = threading.Lock()  # Held from the slot re-check until the booking row is in the index
+        self.sibuk = {}
+        self.generasi = None; self.dibaca = 0; self.sidik_katalog = None
+        self.katalog = KATALOG_DEFAULT
+
+    def _tambah(self, baris_sheet, tgl, jam, kapster, layanan):
+        mulai = str_to_menit(str(jam))
+        self.sibuk.setdefault((str(tgl), str(kapster)), {})[baris_sheet] = (mulai, mulai + self.katalog.durasi(layanan))
+
+    def segarkan(self, katalog):
+        mirror = get_sheet_mirror('Booking'); mirror.sinkron()
+        with mirror.lock, self.lock:
+            if mirror.generasi != self.generasi or katalog.sidik != self.sidik_katalog:
+                self.sibuk = {}; self.dibaca = 0
+                self.generasi = mirror.generasi; self.sidik_katalog = katalog.sidik; self.katalog = katalog
+            if self.dibaca >= len(mirror.rows): return
+            header = mirror.header
+            kol = {c: header.index(c) for c in ['Tanggal', 'Jam', 'Waktu', 'Kapster', 'Status', 'Layanan'] if c in header}
+            kol_jam = kol.get('Jam', kol.get('Waktu'))
+            for i in range(self.dibaca, len(mirror.rows)):
+                row = mirror.rows[i]
+                if row[kol['Status']] == 'Batal': continue
+                self._tambah(i + 2, row[kol['Tanggal']], row[kol_jam], row[kol['Kapster']], row[kol['Layanan']])
+            self.dibaca = len(mirror.rows)
+
+    def catat_booking(self, baris_sheet, tgl, jam, kapster, layanan):
+        with self.lock: self._tambah(baris_sheet, tgl, jam, kapster, layanan)
+
+    def hapus_booking(self, baris_sheet):
+        with self.lock:
+            for interval in self.sibuk.values(): interval.pop(baris_sheet, None)
+
+    def bentrok(self, tgl, kapster, mulai, selesai, kecuali=None, sebelum=None):
+        with self.lock: interval = dict(self.sibuk.get((str(tgl), str(kapster)), {}))
+        return any(s < selesai and e > mulai for baris, (s, e) in interval.items()
+                   if baris != kecuali and (sebelum is None or baris < sebelum))
+
+    def slot_kosong(self, list_tgl, list_kapster, durasi, katalog):
+        # One pass for every (tanggal, kapster): busy minutes via a difference array, then a
+        # prefix sum tells for each 15-minute start whether [start, start + durasi) is clear.
+        self.segarkan(katalog)
+        kunci = [(str(t), str(k)) for t in list_tgl for k in list_kapster]
+        with self.lock: interval = [(r, s, e) for r, kk in enumerate(kunci) for s, e in self.sibuk.get(kk, {}).values()]
+        batas = JAM_TUTUP_MENIT + 1
+        sibuk = np.zeros((len(kunci), batas + 1), dtype=np.int32)
+        if interval:
+            r, s, e = np.array(interval, dtype=np.int64).T
+            np.add.at(sibuk, (r, np.clip(s, 0, batas)), 1); np.add.at(sibuk, (r, np.clip(e, 0, batas)), -1)
+        terpakai = np.zeros((len(kunci), batas + 2), dtype=np.int32)
+        terpakai[:, 1:] = (sibuk.cumsum(axis=1) > 0).cumsum(axis=1)
+        mulai = np.arange(JAM_BUKA_MENIT, JAM_TUTUP_MENIT - durasi + 1, SLOT_MENIT)
+        kosong = (terpakai[:, mulai + durasi] - terpakai[:, mulai]) == 0
+        return kunci, mulai, kosong
+
+@st.cache_resource
+def get_jadwal_index():
+    return JadwalIndex()
+
+def get_kalender_tersedia(tgl_awal, jumlah_hari, list_kapster, durasi_layanan, katalog):
+    # {(tanggal str, kapster): [free "HH:MM"]} for jumlah_hari days from tgl_awal; past slots of today are dropped
+    list_tgl = [tgl_awal + timedelta(days=i) for i in range(jumlah_hari)]
+    kunci, mulai, kosong = get_jadwal_index().slot_kosong(list_tgl, list_kapster, int(durasi_layanan), katalog)
+    hari_ini_server = datetime.utcnow() + timedelta(hours=7)
+    baris_hari_ini = [i for i, (t, _) in enumerate(kunci) if t == str(hari_ini_server.date())]
+    if baris_hari_ini: kosong[baris_hari_ini] &= mulai > hari_ini_server.hour * 60 + hari_ini_server.minute
+    jam_str = [menit_to_str(m) for m in mulai]
+    return {kk: [jam_str[j] for j in np.flatnonzero(kosong[i])] for i, kk in enumerate(kunci)}
+
+def get_jam_tersedia(tanggal_pilihan, kapster_pilihan, durasi_layanan_baru, katalog):
     try:
-        JAM_BUKA_MENIT = 10 * 60  
-        JAM_TUTUP_MENIT = 24 * 60 
-        
-        sheet = get_google_sheet('Booking')
-        data = sheet.get_all_records()
-        df = pd.DataFrame(data)
-        
-        waktu_sibuk = [] 
-        if not df.empty:
-            df = df[
-                (df['Tanggal'].astype(str) == str(tanggal_pilihan)) & 
-                (df['Kapster'] == kapster_pilihan) & 
-                (df['Status'] != 'Batal')
-            ]
-            for _, row in df.iterrows():
-                jam_mulai = str_to_menit(row['Jam'])
-                nama_lay = str(row['Layanan']).strip()
-                durasi_lay = 45 
-                for db_name, db_val in semua_layanan_db.items():
-                    if str(db_name).strip() == nama_lay:
-                        durasi_lay = db_val['Durasi']
-                        break
-                jam_selesai = jam_mulai + durasi_lay
-                waktu_sibuk.append((jam_mulai, jam_selesai))
-
-        list_jam_valid = []
-        for menit_start in range(JAM_BUKA_MENIT, JAM_TUTUP_MENIT, 15):
-            menit_end = menit_start + durasi_layanan_baru
-            if menit_end > JAM_TUTUP_MENIT: continue 
-            is_conflict = False
-            for sibuk_start, sibuk_end in waktu_sibuk:
-                if menit_start < sibuk_end and menit_end > sibuk_start:
-                    is_conflict = True
-                    break
-            if not is_conflict:
-                list_jam_valid.append(menit_to_str(menit_start))
-
-        hari_ini_server = datetime.utcnow() + timedelta(hours=7)
-        if str(tanggal_pilihan) == str(hari_ini_server.date()):
-            menit_sekarang = hari_ini_server.hour * 60 + hari_ini_server.minute
-            list_jam_valid = [j for j in list_jam_valid if str_to_menit(j) > menit_sekarang]
-
-        return list_jam_valid
+        hasil = get_kalender_tersedia(tanggal_pilihan, 1, [kapster_pilihan], durasi_layanan_baru, katalog)
+        return hasil[(str(tanggal_pilihan), str(kapster_pilihan))]
     except Exception as e:
         return ["10:00", "11:00", "12:00"]
 
+# --- BOOKING ID ---
+# Every Booking row carries a stable ID in column M. The locator maps ID -> sheet row from the
+# mirror and from append responses, with no extra read per lookup. Writes to a row send M as null
+# (left as is) and ask for the written range back, so the same request tells whether the row still
+# holds that ID; a sheet sorted or edited by hand is caught there and the mirror is reloaded.
+KOLOM_ID_BOOKING = 13
+
+def buat_id_booking():
+    now = datetime.utcnow() + timedelta(hours=7)
+    return f"BK-{now.strftime('%y%m%d%H%M%S')}-{''.join(random.choices('ABCDEFGHJKLMNPQRSTUVWXYZ23456789', k=4))}"
+
+def baris_booking_baru(data_baris, id_booking):
+    # Pad A..L so the ID always lands in column M
+    return list(data_baris) + [''] * (KOLOM_ID_BOOKING - 1 - len(data_baris)) + [id_booking]
+
+class BookingLocator:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.baris = {}  # ID_Booking -> sheet row
+        self.generasi = None; self.dibaca = 0
+        self.kolom_siap = False  # Header present and blank IDs filled (done on a payment/cancel, not on reads)
+
+    def _pastikan_kolom(self, mirror):
+        # Older sheets have no ID column yet: add the header, then give rows without an ID one, in one
+        # batch that touches only those blank cells (existing IDs are never rewritten from the mirror)
+        sheet = get_google_sheet('Booking')
+        if 'ID_Booking' not in mirror.header:
+            sheet.update_cell(1, KOLOM_ID_BOOKING, 'ID_Booking'); mirror.invalidate(); mirror.sinkron()
+        with mirror.lock:
+            kol = mirror.header.index('ID_Booking')
+            kosong = {i + 2: buat_id_booking() for i, row in enumerate(mirror.rows) if not str(row[kol]).strip()}
+            if not kosong: return
+            sheet.batch_update([{'range': rowcol_to_a1(b, KOLOM_ID_BOOKING), 'values': [[id_baru]]} for b, id_baru in kosong.items()], raw=False)
+            mirror.patch_kolom(kol + 1, kosong)
+            with self.lock: self.baris.update({id_baru: b for b, id_baru in kosong.items()})
+
+    def segarkan(self):
+        # Read-only: mirror sync + ID map; rows without an ID are simply not in the map
+        mirror = get_sheet_mirror('Booking'); mirror.sinkron()
+        with mirror.lock, self.lock:
+            if mirror.generasi != self.generasi: self.baris = {}; self.dibaca = 0; self.generasi = mirror.generasi
+            if 'ID_Booking' not in mirror.header: return
+            kol = mirror.header.index('ID_Booking')
+            for i in range(self.dibaca, len(mirror.rows)):
+                id_booking = str(mirror.rows[i][kol]).strip()
+                if id_booking: self.baris[id_booking] = i + 2
+            self.dibaca = len(mirror.rows)
+
+    def catat(self, id_booking, baris_sheet):
+        with self.lock: self.baris[id_booking] = baris_sheet
+
+    def cari(self, id_booking):
+        # -> (sheet row, ID) from the map, or (None, None). An int is the sheet row of a booking that was
+        # listed before it had an ID: the backfill gives it one first, so the write can still be checked.
+        mirror = get_sheet_mirror('Booking')
+        if isinstance(id_booking, int) or not self.kolom_siap:
+            mirror.sinkron(); self._pastikan_kolom(mirror); self.kolom_siap = True
+        self.segarkan()
+        if isinstance(id_booking, int):
+            with mirror.lock:
+                row = mirror.rows[id_booking - 2] if 0 <= id_booking - 2 < len(mirror.rows) else None
+                id_baris = str(row[mirror.header.index('ID_Booking')]).strip() if row else ''
+            return (id_booking, id_baris) if id_baris else (None, None)
+        for percobaan in range(2):
+            if percobaan: mirror.invalidate(); self.segarkan()  # Not in the map: one full reload, then give up
+            with self.lock: baris = self.baris.get(id_booking)
+            if baris: return baris, id_booking
+        return None, None
+
+@st.cache_resource
+def get_booking_locator():
+    return BookingLocator()
+
 # --- CHECK CUSTOMER DATA ---
+# Process-wide dict: normalized WA (format_wa_0) -> (nama, sheet row, kapster). Built once from the
+# Pelanggan mirror, then only rows the mirror picked up since are indexed, and
+# sync_database_pelanggan updates entries in place.
+KOLOM_PELANGGAN_NAMA = 4; KOLOM_PELANGGAN_KAPSTER = 5  # D, E
+
+def normalisasi_wa_sel(nilai):
+    # Sheet cells may come back as numbers (812xxx) or with a trailing ".0"
+    return format_wa_0(re.sub(r'\.0$', '', str(nilai).strip()))
+
+class PelangganIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.generasi = None; self.dibaca = 0
+        self.kolom_wa = None  # Sheet column of nomor_wa_0
+
+    def _segarkan(self):
+        mirror = get_sheet_mirror('Pelanggan'); mirror.sinkron()
+        with mirror.lock, self.lock:
+            if mirror.generasi != self.generasi:
+                self.data = {}; self.dibaca = 0; self.generasi = mirror.generasi
+            if self.dibaca >= len(mirror.rows): return
+            header = [str(h).lower() for h in mirror.header]
+            kol_wa = next((i for i, h in enumerate(header) if 'nomor_wa_0' in h), None)
+            kol_nama = header.index('nama_pelanggan') if 'nama_pelanggan' in header else None
+            kol_kapster = KOLOM_PELANGGAN_KAPSTER - 1 if len(header) >= KOLOM_PELANGGAN_KAPSTER else None
+            if kol_wa is None: return
+            self.kolom_wa = kol_wa + 1
+            for i in range(self.dibaca, len(mirror.rows)):
+                row = mirror.rows[i]
+                nama = row[kol_nama] if kol_nama is not None else None
+                kapster = row[kol_kapster] if kol_kapster is not None else None
+                self.data.setdefault(normalisasi_wa_sel(row[kol_wa]), (nama, i + 2, kapster))  # First match wins, as before
+            self.dibaca = len(mirror.rows)
+
+    def cari(self, wa_input):
+        self._segarkan()
+        with self.lock: return self.data.get(format_wa_0(wa_input))
+
+    def perbarui(self, wa_pk, nama, baris_sheet, kapster):
+        with self.lock: self.data[wa_pk] = (nama, baris_sheet, kapster)
+
+@st.cache_resource
+def get_pelanggan_index():
+    return PelangganIndex()
+
 def get_data_pelanggan(wa_input):
     try:
-        wa_target = format_wa_0(wa_input) 
-        sheet = get_google_sheet('Pelanggan')
-        data = sheet.get_all_records()
-        df = pd.DataFrame(data)
-        if df.empty: return None
-        df.columns = df.columns.str.strip()
-        col_target = 'nomor_wa_0'
-        if col_target not in df.columns:
-            cols = df.columns.tolist()
-            for c in cols:
-                if 'nomor_wa_0' in str(c).lower(): col_target = c; break
-        
-        df[col_target] = df[col_target].astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
-        df[col_target] = df[col_target].apply(lambda x: '0' + x if x.startswith('8') else x)
-        hasil = df[df[col_target] == wa_target]
-        if not hasil.empty and 'nama_pelanggan' in df.columns:
-            return hasil.iloc[0]['nama_pelanggan']
+        hasil = get_pelanggan_index().cari(wa_input)
+        if hasil and hasil[0]: return hasil[0]
     except Exception as e: print(f"Error Customer Search: {e}")
     return None
 
 # --- SYNC CUSTOMER DATABASE ---
+# Upsert through the customer index: a changed existing customer is one write of name + kapster,
+# a new customer one append_row, and a customer whose name and kapster did not change costs no
+# request at all. The write spans the WA cell too, sent as null (left as is) and echoed back in
+# the same response, so a row that no longer holds that number is caught without an extra read.
 def sync_database_pelanggan(wa_input, nama_final, kapster_pilihan):
     try:
-        sheet = get_google_sheet('Pelanggan')
-        wa_pk = format_wa_0(wa_input) 
-        wa_62 = "62" + wa_pk[1:]
-        cell = None
-        try: cell = sheet.find(wa_pk)
-        except: pass 
-        if cell:
-            row_idx = cell.row
-            sheet.update_cell(row_idx, 4, nama_final) 
-            sheet.update_cell(row_idx, 5, kapster_pilihan) 
-        else:
-            new_row = [wa_input, wa_62, wa_pk, nama_final, kapster_pilihan]
-            sheet.append_row(new_row)
+        index = get_pelanggan_index(); wa_pk = format_wa_0(wa_input)
+        sheet = get_google_sheet('Pelanggan'); mirror = get_sheet_mirror('Pelanggan')
+        for percobaan in range(2):
+            lama = index.cari(wa_pk)
+            if not (lama and lama[1]): break
+            if str(lama[0]).strip() == str(nama_final).strip() and str(lama[2]).strip() == str(kapster_pilihan).strip(): return True
+            baris = lama[1]; kol_awal = min(index.kolom_wa, KOLOM_PELANGGAN_NAMA)
+            nilai = {KOLOM_PELANGGAN_NAMA: nama_final, KOLOM_PELANGGAN_KAPSTER: kapster_pilihan}
+            res = sheet.batch_update([{'range': f"{rowcol_to_a1(baris, kol_awal)}:{rowcol_to_a1(baris, KOLOM_PELANGGAN_KAPSTER)}",
+                                       'values': [[nilai.get(k) for k in range(kol_awal, KOLOM_PELANGGAN_KAPSTER + 1)]]}],
+                                     raw=False, include_values_in_response=True)
+            balik = ((res or {}).get('responses') or [{}])[0].get('updatedData', {}).get('values') or [[]]
+            wa_sel = balik[0][index.kolom_wa - kol_awal] if len(balik[0]) > index.kolom_wa - kol_awal else ''
+            if normalisasi_wa_sel(wa_sel) == wa_pk:
+                mirror.patch_sel(baris, KOLOM_PELANGGAN_NAMA, nama_final); mirror.patch_sel(baris, KOLOM_PELANGGAN_KAPSTER, kapster_pilihan)
+                index.perbarui(wa_pk, nama_final, baris, kapster_pilihan)
+                return True
+            # Sorted/edited by hand since the last reload: reload once and look the number up again
+            print(f"Pelanggan {wa_pk}: baris {baris} ternyata milik {wa_sel}, nama/kapster baris itu tertimpa. Cek sheet Pelanggan!")
+            mirror.invalidate()
+        else: return False
+        baris = baris_dari_append(sheet.append_row([wa_input, "62" + wa_pk[1:], wa_pk, nama_final, kapster_pilihan]))
+        tandai_sheet_berubah('Pelanggan')
+        index.perbarui(wa_pk, nama_final, baris, kapster_pilihan)
         return True
     except Exception as e: print(f"Error Sync: {e}"); return False
 
 # --- GENERATE INVOICE NUMBER ---
+# Monthly counter kept in the Config sheet (row "Nota_<yymm>" | last sequence). It is warmed
+# once per month per process from a scan of the ledger, then every invoice is a lock-protected
+# increment plus one single-cell write. Sequences past 999 simply grow to 4+ digits.
+class InvoiceCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = {}    # prefix_bulan -> last issued sequence
+        self.baris = {}  # prefix_bulan -> Config row of the counter (None = not created yet)
+
+    def _scan_ledger(self, prefix_bulan):
+        df = baca_pemasukan()
+        if df.empty or 'Nota_ID' not in df.columns: return 0
+        nota = df['Nota_ID'].dropna()
+        seq = nota[nota.str.fullmatch(rf'{prefix_bulan}\d{{3,}}')].str[len(prefix_bulan):]
+        return int(seq.astype(int).max()) if not seq.empty else 0
+
+    def _warm(self, prefix_bulan):
+        seq_config = 0; self.baris[prefix_bulan] = None
+        try:
+            mirror = get_sheet_mirror('Config'); mirror.invalidate()  # Fresh read, another process may have moved it
+            df = mirror.get_df()
+            keys = df.iloc[:, 0].astype(str).str.strip() if not df.empty else pd.Series(dtype=str)
+            cocok = keys[keys == f"Nota_{prefix_bulan}"]
+            if not cocok.empty:
+                self.baris[prefix_bulan] = int(cocok.index[0]) + 2
+                try: seq_config = int(df.iloc[cocok.index[0], 1])
+                except (TypeError, ValueError): seq_config = 0
+        except Exception as e: print(f"Counter nota di Config tidak terbaca, pakai scan ledger: {e}")
+        self.seq[prefix_bulan] = max(seq_config, self._scan_ledger(prefix_bulan))
+
+    def _simpan(self, prefix_bulan, seq):
+        sheet = get_google_sheet('Config'); baris = self.baris[prefix_bulan]
+        if baris:
+            sheet.update_cell(baris, 2, seq)
+            get_sheet_mirror('Config').patch_sel(baris, 2, seq)
+        else:
+            self.baris[prefix_bulan] = baris_dari_append(sheet.append_row([f"Nota_{prefix_bulan}", seq]))
+            tandai_sheet_berubah('Config')
+
+    def berikut(self):
+        prefix_bulan = (datetime.utcnow() + timedelta(hours=7)).strftime("%y%m")
+        with self.lock:
+            if prefix_bulan not in self.seq: self._warm(prefix_bulan)
+            seq = self.seq[prefix_bulan] + 1
+            self.seq[prefix_bulan] = seq  # Claimed in memory first: a failed write leaves a gap, never a duplicate
+            try: self._simpan(prefix_bulan, seq)
+            except Exception as e: print(f"Counter nota tidak tersimpan di Config (lanjut lokal): {e}")
+        return f"{prefix_bulan}{seq:03d}"
+
+@st.cache_resource
+def get_invoice_counter():
+    return InvoiceCounter()
+
 def get_next_invoice_number():
-    try:
-        now = datetime.utcnow() + timedelta(hours=7)
-        prefix_bulan = now.strftime("%y%m")
-        sheet = get_google_sheet('Pemasukan')
-        data = sheet.get_all_records()
-        df = pd.DataFrame(data)
-        next_sequence = 1
-        
-        if not df.empty and 'Keterangan' in df.columns:          
-            import re
-            max_seq = 0
-            found = False
-            for ket in df['Keterangan']:
-                match = re.search(rf'\[({prefix_bulan}(\d{{3}}))\]', str(ket))
-                if match:
-                    found = True
-                    seq_int = int(match.group(2))
-                    if seq_int > max_seq: max_seq = seq_int
-            if found: next_sequence = max_seq + 1
-        
-        return f"{prefix_bulan}{next_sequence:03d}"
-    except: return datetime.now().strftime("%y%m001")
+    return get_invoice_counter().berikut()
 
 # --- DATABASE WRITE FUNCTIONS ---
+def tolak_slot_bentrok(tgl, jam, kapster, durasi):
+    st.warning(f"⚠️ Jam {jam} untuk {kapster} baru saja dipesan pelanggan lain.")
+    jam_lain = get_jam_tersedia(tgl, kapster, durasi, get_daftar_layanan())
+    if jam_lain: st.info(f"Jam yang masih kosong: {', '.join(jam_lain[:8])}")
+    else: st.info("Jadwal hari itu sudah penuh, silakan pilih tanggal lain.")
+    return False
+
+def tolak_jam_hilang(tgl, jam, kapster, durasi):
+    # The chosen time dropped out of the list: "taken" only if the occupancy index has a booking there
+    # (it may also have passed, or the slot grid moved with a new duration)
+    mulai = str_to_menit(str(jam))
+    if get_jadwal_index().bentrok(tgl, kapster, mulai, mulai + int(durasi)): return tolak_slot_bentrok(tgl, jam, kapster, durasi)
+    st.info(f"Jam {jam} sudah tidak bisa dipilih, silakan pilih jam lain.")
+    return False
+
 def simpan_booking(nama, no_wa, kapster, layanan, tgl, jam):
     try:
         sheet = get_google_sheet('Booking')
+        index = get_jadwal_index(); mirror = get_sheet_mirror('Booking')
         waktu_input = (datetime.utcnow() + timedelta(hours=7)).strftime("%Y-%m-%d %H:%M:%S")
-        data_baru = [str(tgl), jam, nama, str(no_wa), kapster, layanan, "Pending", waktu_input]
-        sheet.append_row(data_baru)
-        st.cache_data.clear()
+        id_booking = buat_id_booking()
+        data_baru = baris_booking_baru([str(tgl), jam, nama, str(no_wa), kapster, layanan, "Pending", waktu_input], id_booking)
+        with index.reservasi:
+            # Re-check against the occupancy index after a tail sync (only rows appended since the last read)
+            mirror.tandai_append(); index.segarkan(get_daftar_layanan())
+            mulai = str_to_menit(str(jam)); durasi = index.katalog.durasi(layanan)
+            if index.bentrok(tgl, kapster, mulai, mulai + durasi): return tolak_slot_bentrok(tgl, jam, kapster, durasi)
+            baris_baru = baris_dari_append(sheet.append_row(data_baru))
+            tandai_sheet_berubah('Booking')
+            if baris_baru:
+                get_booking_locator().catat(id_booking, baris_baru)
+                index.catat_booking(baris_baru, tgl, jam, kapster, layanan)
+                # Another instance may have appended the same slot between our check and our append: the earlier row keeps it
+                index.segarkan(get_daftar_layanan())
+                if index.bentrok(tgl, kapster, mulai, mulai + durasi, kecuali=baris_baru, sebelum=baris_baru):
+                    batalkan_booking(id_booking, "Bentrok jadwal (otomatis)")
+                    return tolak_slot_bentrok(tgl, jam, kapster, durasi)
         return True
     except Exception as e: st.error(f"Error: {e}"); return False
 
-def proses_pembayaran(baris_ke, nama_pelanggan, list_items, metode_bayar, kapster, diskon_nominal, harga_akhir):
+def proses_pembayaran(id_booking, nama_pelanggan, list_items, metode_bayar, kapster, diskon_nominal, harga_akhir):
+    # Booking row (status G, nota I, diskon K, harga L) goes out as one batch_update and the ledger
+    # as one append. If the ledger append fails the booking row is put back as it was.
+    mirror_bk = get_sheet_mirror('Booking')
     try:
-        sheet_booking = get_google_sheet('Booking')
-        sheet_booking.update_cell(baris_ke + 2, 7, "Selesai") 
-        no_nota = get_next_invoice_number() 
-        try:
-            sheet_booking.update_cell(baris_ke + 2, 9, no_nota)
-            sheet_booking.update_cell(baris_ke + 2, 11, diskon_nominal)
-            sheet_booking.update_cell(baris_ke + 2, 12, harga_akhir)
-        except: pass
-        
         sheet_uang = get_google_sheet('Pemasukan')
+        baris_sheet, id_booking = get_booking_locator().cari(id_booking)
+        if not baris_sheet: st.error("Booking tidak ditemukan di sheet."); return None
+        no_nota = get_next_invoice_number() 
         waktu_obj = datetime.utcnow() + timedelta(hours=7)
         tgl_skrg = waktu_obj.strftime("%Y-%m-%d")
         jam_skrg = waktu_obj.strftime("%H:%M:%S")
@@ -423,16 +1022,55 @@ def proses_pembayaran(baris_ke, nama_pelanggan, list_items, metode_bayar, kapste
         if diskon_nominal > 0:
             ket_diskon = f"[{no_nota}] Promo/Diskon - {kapster}"
             rows_to_append.append([tgl_skrg, jam_skrg, "Potongan Diskon", ket_diskon, -diskon_nominal])
-            
+        
+        nilai_baru = {7: "Selesai", 9: no_nota, 11: diskon_nominal, 12: harga_akhir}
+        nilai_lama = mirror_bk.nilai_baris(baris_sheet, nilai_baru.keys())
+        try: baris_benar = tulis_baris_booking(baris_sheet, id_booking, nilai_baru)
+        except Exception: mirror_bk.invalidate(); raise  # The next attempt looks the row up on a fresh mirror
+        if not baris_benar: tolak_baris_salah(mirror_bk, baris_sheet, id_booking, nilai_baru); return None
+        for kol, val in nilai_baru.items(): mirror_bk.patch_sel(baris_sheet, kol, val)
+    except Exception as e: st.error(f"Gagal: {e}"); return None
+    
+    try:
         sheet_uang.append_rows(rows_to_append)
+        tandai_sheet_berubah('Pemasukan')
         return no_nota 
-    except Exception as e: st.error(f"Gagal: {e}"); return None
-
-def batalkan_booking(baris_ke, alasan):
+    except Exception as e:
+        try:
+            tulis_baris_booking(baris_sheet, id_booking, nilai_lama)
+            for kol, val in nilai_lama.items(): mirror_bk.patch_sel(baris_sheet, kol, val)
+            st.error(f"Gagal mencatat pemasukan, booking dikembalikan: {e}")
+        except Exception as e2:
+            mirror_bk.invalidate()
+            st.error(f"Gagal mencatat pemasukan untuk nota {no_nota} (baris {baris_sheet}) dan rollback gagal: {e2}. Cek sheet Booking!")
+        return None
+
+def tulis_baris_booking(baris_sheet, id_booking, nilai_per_kolom):
+    # {kolom: nilai} of one Booking row as a single G..M range; untouched cells (and M) go as null, and
+    # the range comes back in the same response. -> False if M did not hold id_booking (nothing else is read)
+    kolom = range(7, KOLOM_ID_BOOKING + 1)
+    res = get_google_sheet('Booking').batch_update(
+        [{'range': f"{rowcol_to_a1(baris_sheet, 7)}:{rowcol_to_a1(baris_sheet, KOLOM_ID_BOOKING)}", 'values': [[nilai_per_kolom.get(k) for k in kolom]]}],
+        raw=False, include_values_in_response=True)
+    balik = ((res or {}).get('responses') or [{}])[0].get('updatedData', {}).get('values') or [[]]
+    return len(balik[0]) >= len(kolom) and str(balik[0][len(kolom) - 1]).strip() == id_booking
+
+def tolak_baris_salah(mirror_bk, baris_sheet, id_booking, kolom):
+    # The echo showed another booking in that row (sheet sorted/edited by hand since the last reload)
+    mirror_bk.invalidate()
+    st.error(f"Baris {baris_sheet} sheet Booking ternyata bukan booking {id_booking} (sheet diurutkan/diedit?). "
+             f"Kolom {', '.join(rowcol_to_a1(1, k)[:-1] for k in kolom)} baris itu sudah tertimpa, cek lalu ulangi.")
+
+def batalkan_booking(id_booking, alasan):
     try:
-        sheet_booking = get_google_sheet('Booking')
-        sheet_booking.update_cell(baris_ke + 2, 7, "Batal")
-        sheet_booking.update_cell(baris_ke + 2, 10, alasan)
+        baris_sheet, id_booking = get_booking_locator().cari(id_booking)
+        if not baris_sheet: st.error("Booking tidak ditemukan di sheet."); return False
+        mirror_bk = get_sheet_mirror('Booking'); nilai_baru = {7: "Batal", 10: alasan}
+        try: baris_benar = tulis_baris_booking(baris_sheet, id_booking, nilai_baru)
+        except Exception: mirror_bk.invalidate(); raise
+        if not baris_benar: tolak_baris_salah(mirror_bk, baris_sheet, id_booking, nilai_baru); return False
+        for kol, val in nilai_baru.items(): mirror_bk.patch_sel(baris_sheet, kol, val)
+        get_jadwal_index().hapus_booking(baris_sheet)
         return True
     except Exception as e: st.error(f"Gagal membatalkan: {e}"); return False
 
@@ -441,16 +1079,15 @@ def simpan_transaksi_pomade(nama_pomade, nominal, keterangan, link_foto):
         sheet = get_google_sheet('Pomade')
         w = datetime.utcnow() + timedelta(hours=7)
         sheet.append_row([w.strftime("%Y-%m-%d"), w.strftime("%H:%M:%S"), nama_pomade, nominal, keterangan, link_foto])
+        tandai_sheet_berubah('Pomade')
         return True
     except Exception as e: st.error(f"Gagal menyimpan data: {e}"); return False
 
 def get_rekap_pomade_harian():
     try:
-        sheet = get_google_sheet('Pomade')
-        data = sheet.get_all_records()
-        if not data: return pd.DataFrame() 
-        df = pd.DataFrame(data)
-        tgl_hari_ini = (datetime.utcnow() + timedelta(hours=7)).strftime("%Y-%m-%d")
+        df = baca_bertipe('Pomade')
+        if df.empty: return pd.DataFrame() 
+        tgl_hari_ini = pd.Timestamp((datetime.utcnow() + timedelta(hours=7)).date())
         df_filtered = df[df['Tanggal'] == tgl_hari_ini].copy()
         if 'Tanggal' in df_filtered.columns:
             df_filtered = df_filtered.drop(columns=['Tanggal', 'Link_Bukti'])
@@ -462,25 +1099,497 @@ def simpan_pengeluaran(nama_pengeluaran, ket_tambahan, nominal):
         sheet = get_google_sheet('Pengeluaran')
         w = datetime.utcnow() + timedelta(hours=7)
         sheet.append_row([w.strftime("%Y-%m-%d"), w.strftime("%H:%M:%S"), nama_pengeluaran, ket_tambahan, nominal])
+        tandai_sheet_berubah('Pengeluaran')
         return True
     except: return False
 
+# --- CONFIG STORE ---
+# Config rows (Key | Value) as a dict built from the Config sheet mirror (shared with the invoice
+# counter). Loaded once; at most every CONFIG_TTL_DETIK the mirror is reloaded in the background so
+# edits from another process or the sheet still arrive, and a read never waits on the network once
+# loaded. Writes from this process update memory immediately.
+CONFIG_TTL_DETIK = 60
+KUNCI_DISKON = 'Diskon'; BARIS_DISKON = 2  # The discount lock has always lived in B2, whatever A2 is labelled
+
+class ConfigStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nilai = {}; self.baris = {KUNCI_DISKON: BARIS_DISKON}  # key -> value, key -> sheet row
+        self.versi = None; self.waktu = None; self.memuat = False
+        self.ditulis = {}  # key -> value written by simpan() since the current load started
+
+    def _bangun(self, mirror):
+        # Rebuild the dict from the mirror's rows (no network)
+        with mirror.lock:
+            nilai = {}; baris = {}
+            for i, row in enumerate(mirror.rows, start=2):
+                kunci = str(row[0]).strip() if row else ''
+                if kunci: nilai[kunci] = row[1] if len(row) > 1 else ''; baris[kunci] = i
+            row_diskon = mirror.rows[BARIS_DISKON - 2] if len(mirror.rows) > BARIS_DISKON - 2 else []
+            nilai[KUNCI_DISKON] = row_diskon[1] if len(row_diskon) > 1 else ''
+            baris[KUNCI_DISKON] = BARIS_DISKON
+            with self.lock: self.nilai, self.baris = nilai, baris; self.versi = mirror.versi
+
+    def _muat(self, paksa=True):
+        try:
+            mirror = get_sheet_mirror('Config')
+            with self.lock: self.ditulis = {}
+            with mirror.lock:
+                if paksa: mirror.invalidate()
+                mirror.sinkron()
+                # The reload may have been fetched before a simpan() that landed meanwhile: put those writes back
+                with self.lock: ditulis = dict(self.ditulis); baris = dict(self.baris)
+                for kunci, nilai in ditulis.items():
+                    if baris.get(kunci): mirror.patch_sel(baris[kunci], 2, nilai)
+                self._bangun(mirror)
+        except Exception as e: print(f"Config tidak terbaca: {e}")
+        finally:
+            with self.lock: self.waktu = time.monotonic(); self.memuat = False  # On failure: defaults until the next TTL retry
+
+    def ambil(self, kunci, default=None):
+        mirror = get_sheet_mirror('Config')
+        with self.lock:
+            kosong = self.waktu is None
+            basi = not kosong and time.monotonic() - self.waktu > CONFIG_TTL_DETIK and not self.memuat
+            if basi: self.memuat = True
+            berubah = not kosong and self.versi != mirror.versi
+        if kosong: self._muat(paksa=False)  # The invoice counter may already have loaded the mirror
+        elif basi: get_io_pool().submit(self._muat)  # Serve the current value, refresh behind it
+        elif berubah: self._bangun(mirror)  # The mirror moved (reload or a patch from this process)
+        with self.lock: return self.nilai.get(kunci) or default
+
+    def simpan(self, kunci, nilai):
+        sheet = get_google_sheet('Config')
+        with self.lock: baris = self.baris.get(kunci); self.ditulis[kunci] = nilai  # Before the write: see _muat
+        try:
+            if baris: sheet.update_cell(baris, 2, nilai); get_sheet_mirror('Config').patch_sel(baris, 2, nilai)
+            else: baris = baris_dari_append(sheet.append_row([kunci, nilai])); tandai_sheet_berubah('Config')
+        except Exception:
+            with self.lock: self.ditulis.pop(kunci, None)
+            raise
+        with self.lock: self.nilai[kunci] = nilai; self.baris[kunci] = baris
+
+@st.cache_resource
+def get_config_store():
+    return ConfigStore()
+
 def get_diskon_status():
-    try:
-        sh = get_google_sheet('Config')
-        val = sh.cell(2, 2).value
-        return val if val else 'UNLOCKED'
-    except: return 'UNLOCKED'
+    return get_config_store().ambil(KUNCI_DISKON, 'UNLOCKED')
 
 def set_diskon_status(status_baru):
     try:
-        sh = get_google_sheet('Config')
-        sh.update_cell(2, 2, status_baru)
-        st.cache_data.clear()
+        get_config_store().simpan(KUNCI_DISKON, status_baru)
         return True
     except: return False
 
+# --- DAILY ROLLUP ---
+# Pre-aggregated ledgers: per (Tanggal, Kapster) totals, per (Tanggal, Kapster, Item) menu
+# counts and per Tanggal expenses. Backfilled once from the full sheets and kept on disk, then
+# each payment or expense only adds the aggregates of the rows the mirror appended (a nota is
+# appended in one call, so it never straddles two updates). After a full mirror reload (manual
+# edits, or a restart) each date's ledger rows are compared by hash with what was folded in, and
+# only the dates that differ are aggregated again. Reports read ~31 rows per month per kapster
+# instead of rescanning the ledger.
+KAPSTER_KOSONG = '-'  # Ledger rows without a parsable kapster still count for cash and profit
+RINGKASAN_FILE = os.path.join('.cache', 'ringkasan_harian.pkl')
+KOLOM_HARIAN = ['masuk', 'masuk_pos', 'masuk_neg', 'tunai', 'n_tunai', 'qris', 'n_qris', 'kepala', 'gross', 'disc', 'n_diskon']
+
+def _agregat_pemasukan(df):
+    # Parsed ledger rows -> (harian, menu); "Up from" items absorb their nota's "Biaya Upgrade" lines
+    if df.empty or 'Nota_ID' not in df.columns:
+        return (pd.DataFrame(columns=KOLOM_HARIAN, index=pd.MultiIndex.from_tuples([], names=['Tanggal', 'Kapster'])),
+                pd.DataFrame(columns=['qty', 'gross'], index=pd.MultiIndex.from_tuples([], names=['Tanggal', 'Kapster', 'Item'])))
+    df = df[df['Tanggal'].notna()]
+    kap = df['Kapster'].astype(object).where(df['Kapster'].notna(), KAPSTER_KOSONG)
+    nom = df['Nominal']; ada_nota = df['Nota_ID'].notna(); metode = df['Metode'].astype(object)
+    d = pd.DataFrame({
+        'Tanggal': df['Tanggal'], 'Kapster': kap,
+        'masuk': nom, 'masuk_pos': nom.where(nom > 0, 0), 'masuk_neg': nom.where(nom < 0, 0),
+        'tunai': nom.where(metode == 'Tunai', 0), 'n_tunai': (metode == 'Tunai').astype('int64'),
+        'qris': nom.where(metode == 'QRIS', 0), 'n_qris': (metode == 'QRIS').astype('int64'),
+        'kepala': 0, 'gross': nom.where(ada_nota & (nom > 0), 0), 'disc': -nom.where(ada_nota & (nom < 0), 0),
+        'n_diskon': (nom < 0).astype('int64'),
+    })
+    harian = d.groupby(['Tanggal', 'Kapster'], sort=False)[KOLOM_HARIAN].sum()
+    kepala = df[ada_nota].assign(Kapster=kap).groupby(['Tanggal', 'Kapster'], sort=False)['Nota_ID'].nunique()
+    harian['kepala'] = kepala.reindex(harian.index, fill_value=0)
+
+    kunci = ['Tanggal', 'Kapster', 'Nota_ID']
+    pos = df[ada_nota & (nom > 0)].assign(Kapster=kap, Item=df['Item'].astype(str)).sort_values(kunci, kind='stable')
+    item_lower = pos['Item'].str.lower()
+    is_upg = item_lower.str.contains('biaya upgrade', regex=False); is_up = item_lower.str.contains('up from', regex=False)
+    grup = [pos[k] for k in kunci]
+    tot_upg = pos['Nominal'].where(is_upg, 0).groupby(grup).transform('sum')
+    pertama_up = is_up & (is_up.astype(int).groupby(grup).cumsum() == 1)
+    gabung = is_up.groupby(grup).transform('any') & (tot_upg > 0)
+    target = pertama_up & gabung
+    pos = pos.assign(
+        Nominal=pos['Nominal'] + tot_upg.where(target, 0),
+        Item=pos['Item'].where(~target, pos['Item'].str.split(' (Up from', regex=False).str[0].str.strip()),
+    )[~(gabung & is_upg & ~target)]
+    menu = pos.groupby(['Tanggal', 'Kapster', 'Item'], sort=False)['Nominal'].agg(qty='size', gross='sum')
+    return harian, menu
+
+def _gabung_agregat(lama, baru):
+    # Add two aggregate frames/series keyed the same way, keeping first-seen order
+    if lama is None or len(lama) == 0: return baru
+    if len(baru) == 0: return lama
+    return pd.concat([lama, baru]).groupby(level=list(range(lama.index.nlevels)), sort=False).sum()
+
+def _sidik_per_tanggal(df_mentah, tanggal):
+    # Content hash of the ledger rows of each date (sum of row hashes, so appended rows just add on)
+    if df_mentah.empty: return pd.Series(dtype='uint64')
+    h = pd.util.hash_pandas_object(df_mentah.astype(str), index=False)
+    return h[tanggal.notna().to_numpy()].groupby(tanggal[tanggal.notna()].to_numpy(), sort=False).sum()
+
+def _buang_tanggal(x, tanggal):
+    return x if x is None or len(x) == 0 or not tanggal else x[~x.index.get_level_values(0).isin(list(tanggal))]
+
+class RingkasanHarian:
+    def __init__(self, file=RINGKASAN_FILE):
+        self.file = file
+        self.lock = threading.Lock()
+        self.harian = None; self.menu = None; self.keluar = None
+        self.sidik_tanggal = {'Pemasukan': None, 'Pengeluaran': None}  # sheet -> per-date hash of the rows folded in
+        self.posisi = {'Pemasukan': (None, 0), 'Pengeluaran': (None, 0)}  # sheet -> (mirror generasi, rows folded in)
+        try:
+            data = pd.read_pickle(file)
+            self.harian, self.menu, self.keluar, self.sidik_tanggal = data['harian'], data['menu'], data['keluar'], data['sidik_tanggal']
+        except Exception as e:
+            if not isinstance(e, FileNotFoundError): print(f"Ringkasan harian tidak terbaca, dibangun ulang: {e}")
+
+    def _simpan(self):
+        try:
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+            pd.to_pickle({'harian': self.harian, 'menu': self.menu, 'keluar': self.keluar, 'sidik_tanggal': self.sidik_tanggal}, self.file + ".tmp")
+            os.replace(self.file + ".tmp", self.file)
+        except Exception as e: print(f"Ringkasan harian gagal disimpan: {e}")  # Still held in memory
+
+    def _baris_baru(self, sheet_name):
+        # ('penuh', raw df, typed df) after a (re)load, ('ekor', ...) of the new rows only, or (None, None, None)
+        mirror = get_sheet_mirror(sheet_name); mirror.sinkron()
+        with mirror.lock:
+            generasi, dibaca = self.posisi[sheet_name]
+            if generasi != mirror.generasi: mode, rows = 'penuh', mirror.rows
+            elif dibaca < len(mirror.rows): mode, rows = 'ekor', mirror.rows[dibaca:]
+            else: return None, None, None
+            df = pd.DataFrame([list(r) for r in rows], columns=mirror.header)
+            self.posisi[sheet_name] = (mirror.generasi, len(mirror.rows))
+        return mode, df, ketik_df(df, sheet_name)
+
+    def _baris_berubah(self, sheet_name):
+        # -> (typed rows to fold in, dates to drop from the rollup first); (None, None) when nothing is new.
+        # Dates None = no rollup for this sheet yet, build it from these rows.
+        mode, mentah, df = self._baris_baru(sheet_name)
+        if not mode: return None, None
+        tanggal = df['Tanggal'] if 'Tanggal' in df.columns else pd.Series(pd.NaT, index=df.index)
+        sidik = _sidik_per_tanggal(mentah, tanggal); lama = self.sidik_tanggal[sheet_name]
+        if mode == 'ekor':
+            self.sidik_tanggal[sheet_name] = _gabung_agregat(lama, sidik)
+            return df, set()
+        self.sidik_tanggal[sheet_name] = sidik
+        if lama is None: return df, None
+        semua = lama.index.union(sidik.index)
+        berubah = set(semua[lama.reindex(semua).ne(sidik.reindex(semua))])
+        return df[tanggal.isin(list(berubah))], berubah
+
+    def segarkan(self):
+        sinkron_batch(['Pemasukan', 'Pengeluaran'])  # Both ledgers in one round trip; _baris_baru then finds them fresh
+        with self.lock:
+            berubah = set(); dibangun_ulang = False
+            df, buang = self._baris_berubah('Pemasukan')
+            if df is not None:
+                harian, menu = _agregat_pemasukan(urai_keterangan(df))
+                if buang is None: self.harian, self.menu = harian, menu; dibangun_ulang = True
+                else:
+                    self.harian = _gabung_agregat(_buang_tanggal(self.harian, buang), harian)
+                    self.menu = _gabung_agregat(_buang_tanggal(self.menu, buang), menu)
+                    berubah.update(buang); berubah.update(harian.index.get_level_values(0))
+            df, buang = self._baris_berubah('Pengeluaran')
+            if df is not None:
+                keluar = df[df['Tanggal'].notna()].groupby('Tanggal', sort=False)['Nominal'].sum() if 'Nominal' in df.columns else pd.Series(dtype='int64')
+                if buang is None: self.keluar = keluar; dibangun_ulang = True
+                else: self.keluar = _gabung_agregat(_buang_tanggal(self.keluar, buang), keluar); berubah.update(buang); berubah.update(keluar.index)
+            if berubah or dibangun_ulang: self._simpan()
+            # Rows dated in a closed period (backdated corrections, edits) drop that period's cached report
+            if berubah: get_cache_laporan().hapus_tanggal(berubah)
+            if dibangun_ulang: get_cache_laporan().validasi(self._sidik)
+
+    def siap(self):
+        # Synced with the ledger at least once in this process (a rollup from disk alone may be behind)
+        with self.lock: return self.posisi['Pemasukan'][0] is not None
+
+    def _potong(self, x, tgl_awal, tgl_akhir):
+        if x is None or len(x) == 0: return x
+        tgl = x.index.get_level_values(0)
+        return x[(tgl >= pd.Timestamp(tgl_awal)) & (tgl <= pd.Timestamp(tgl_akhir))]
+
+    def _sidik(self, tgl_awal, tgl_akhir):
+        # Content hash of the rollup rows of a period (stable across restarts)
+        bagian = []
+        for x in (self.harian, self.menu, self.keluar):
+            x = self._potong(x, tgl_awal, tgl_akhir)
+            bagian.append(str(int(pd.util.hash_pandas_object(x).sum())) if x is not None and len(x) else '0')
+        return ':'.join(bagian)
+
+    def sidik(self, tgl_awal, tgl_akhir):
+        self.segarkan()
+        with self.lock: return self._sidik(tgl_awal, tgl_akhir)
+
+    def periode(self, tgl_awal, tgl_akhir):
+        # (harian, menu, keluar) rows with tgl_awal <= Tanggal <= tgl_akhir
+        self.segarkan()
+        with self.lock: return tuple(self._potong(x, tgl_awal, tgl_akhir) for x in (self.harian, self.menu, self.keluar))
+
+@st.cache_resource
+def get_ringkasan_harian():
+    return RingkasanHarian()
+
+# --- REPORT ENGINE (WEEKLY / MONTHLY) ---
+def hitung_laporan_kapster(tgl_awal, tgl_akhir, kapsters, label_diskon='🔻 Diskon'):
+    # -> ({kapster: {'kepala','gross','disc','net','details'}}, {'kepala','gross','disc','net'}) from the daily rollup
+    laporan = {k: {'kepala': 0, 'gross': 0, 'disc': 0, 'net': 0, 'details': []} for k in kapsters}
+    total = {'kepala': 0, 'gross': 0, 'disc': 0, 'net': 0}
+    harian, menu, _ = get_ringkasan_harian().periode(tgl_awal, tgl_akhir)
+    if harian is None or harian.empty: return laporan, total
+    per_kapster = harian.groupby(level='Kapster').sum()
+    menu_kapster = menu.groupby(level=['Kapster', 'Item'], sort=False).sum() if len(menu) else menu
+
+    for k in kapsters:
+        if k not in per_kapster.index: continue
+        r = per_kapster.loc[k]; k_gross = int(r['gross']); k_disc = int(r['disc'])
+        details = [{'Menu': m, 'Qty': int(q), 'Gross': int(g)} for (kk, m), q, g in zip(menu_kapster.index, menu_kapster['qty'], menu_kapster['gross']) if kk == k]
+        if k_disc > 0: details.append({'Menu': label_diskon, 'Qty': int(r['n_diskon']), 'Gross': -k_disc})
+        laporan[k] = {'kepala': int(r['kepala']), 'gross': k_gross, 'disc': k_disc, 'net': k_gross - k_disc, 'details': details}
+        for f in total: total[f] += laporan[k][f]
+    return laporan, total
+
+# --- CLOSED-PERIOD REPORT CACHE ---
+# Reports for a week/month that has already ended are kept as JSON files keyed by (report,
+# start, end) together with the rollup fingerprint they were computed from, so they survive
+# restarts. The open period is always recomputed. A backdated row drops the periods containing
+# its date, and after a full rollup rebuild every entry is checked against its fingerprint.
+CACHE_LAPORAN_DIR = os.path.join('.cache', 'laporan')
+
+class CacheLaporan:
+    def __init__(self, folder=CACHE_LAPORAN_DIR):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.isi = {}  # (jenis, awal, akhir) -> (sidik, hasil)
+        try:
+            for nama in os.listdir(folder):
+                if not nama.endswith('.json'): continue
+                with open(os.path.join(folder, nama), encoding='utf-8') as f: data = json.load(f)
+                self.isi[tuple(data['kunci'])] = (data['sidik'], data['hasil'])
+        except Exception as e:
+            if not isinstance(e, FileNotFoundError): print(f"Cache laporan tidak terbaca: {e}")
+
+    def _file(self, kunci):
+        return os.path.join(self.folder, "_".join(kunci) + ".json")
+
+    def ambil(self, kunci):
+        with self.lock: return self.isi.get(kunci)
+
+    def simpan(self, kunci, sidik, hasil):
+        with self.lock:
+            self.isi[kunci] = (sidik, hasil)
+            try:
+                os.makedirs(self.folder, exist_ok=True)
+                sementara = self._file(kunci) + ".tmp"
+                with open(sementara, 'w', encoding='utf-8') as f: json.dump({'kunci': list(kunci), 'sidik': sidik, 'hasil': hasil}, f)
+                os.replace(sementara, self._file(kunci))
+            except Exception as e: print(f"Cache laporan gagal disimpan: {e}")  # Still cached in memory
+
+    def hapus(self, kunci):
+        with self.lock:
+            self.isi.pop(kunci, None)
+            try: os.remove(self._file(kunci))
+            except OSError: pass
+
+    def hapus_tanggal(self, tanggal_list):
+        tanggal = {str(pd.Timestamp(t).date()) for t in tanggal_list}
+        with self.lock: kena = [k for k in self.isi if any(k[1] <= t <= k[2] for t in tanggal)]
+        for k in kena: self.hapus(k)
+
+    def validasi(self, fungsi_sidik):
+        with self.lock: daftar = list(self.isi.items())
+        for kunci, (sidik, _) in daftar:
+            if fungsi_sidik(kunci[1], kunci[2]) != sidik: self.hapus(kunci)
+
+@st.cache_resource
+def get_cache_laporan():
+    return CacheLaporan()
+
+def laporan_periode(jenis, tgl_awal, tgl_akhir, hitung):
+    # hitung() -> JSON-able result. Closed periods come from the cache when their fingerprint still matches.
+    if tgl_akhir >= (datetime.utcnow() + timedelta(hours=7)).date(): return hitung()
+    cache = get_cache_laporan(); ringkasan = get_ringkasan_harian()
+    kunci = (jenis, str(tgl_awal), str(tgl_akhir))
+    simpanan = cache.ambil(kunci)
+    if simpanan and not ringkasan.siap():
+        # Fresh process: serve from disk now and build the rollup in the background; the full build re-checks every entry
+        get_io_pool().submit(ringkasan.segarkan)
+        return simpanan[1]
+    sidik = ringkasan.sidik(tgl_awal, tgl_akhir)
+    if simpanan and simpanan[0] == sidik: return simpanan[1]
+    hasil = hitung()
+    cache.simpan(kunci, sidik, hasil)
+    return hasil
+
+def hitung_profit(tgl_awal, tgl_akhir):
+    harian, _, keluar = get_ringkasan_harian().periode(tgl_awal, tgl_akhir)
+    rev = int(harian['masuk_pos'].sum()) if harian is not None and len(harian) else 0
+    disc = abs(int(harian['masuk_neg'].sum())) if harian is not None and len(harian) else 0
+    return {'rev': rev, 'disc': disc, 'exp': int(keluar.sum()) if keluar is not None else 0}
+
+# --- RANGE ANALYTICS ---
+# Any start/end date at day, week (Mon-Sun) or month granularity, straight from the daily rollup in
+# one pass. Periods without sales are kept as zero rows so series from different ranges line up.
+GRANULARITAS = {'Day': 'D', 'Week': 'W-SUN', 'Month': 'M'}
+METRIK_ANALITIK = ['kepala', 'gross', 'disc', 'net']
+
+def seri_analitik(tgl_awal, tgl_akhir, granularitas='Day', kapsters=None):
+    # -> (per_kapster indexed (Periode, Kapster), toko indexed Periode with keluar/laba added); Periode = first day of the bucket
+    kapsters = list(kapsters or INFO_KAPSTER.keys()); freq = GRANULARITAS[granularitas]
+    harian, _, keluar = get_ringkasan_harian().periode(tgl_awal, tgl_akhir)
+    semua = pd.period_range(pd.Timestamp(tgl_awal), pd.Timestamp(tgl_akhir), freq=freq).start_time
+    if harian is not None and len(harian):
+        h = harian.reset_index()
+        h['Periode'] = h['Tanggal'].dt.to_period(freq).dt.start_time
+        h['net'] = h['gross'] - h['disc']
+        per_kapster = h.groupby(['Periode', 'Kapster'], observed=True)[METRIK_ANALITIK].sum()
+        masuk = h.groupby('Periode')['masuk'].sum()
+    else: per_kapster = pd.DataFrame(columns=METRIK_ANALITIK, dtype='int64'); masuk = pd.Series(dtype='int64')
+    per_kapster = per_kapster.reindex(pd.MultiIndex.from_product([semua, kapsters], names=['Periode', 'Kapster']), fill_value=0).astype('int64')
+    toko = per_kapster.groupby(level='Periode').sum()
+    toko['masuk'] = masuk.reindex(semua, fill_value=0).astype('int64').values
+    if keluar is not None and len(keluar):
+        keluar = keluar.groupby(keluar.index.to_period(freq).start_time).sum()
+    toko['keluar'] = (keluar if keluar is not None else pd.Series(dtype='int64')).reindex(semua, fill_value=0).astype('int64').values
+    toko['laba'] = toko['masuk'] - toko['keluar']
+    return per_kapster, toko
+
+def bandingkan_periode(daftar_periode, kapsters=None):
+    # daftar_periode = [(awal, akhir), ...] -> one row per kapster + 'Total', columns (metric, "awal – akhir")
+    kapsters = list(kapsters or INFO_KAPSTER.keys())
+    harian, _, keluar = get_ringkasan_harian().periode(min(a for a, _ in daftar_periode), max(b for _, b in daftar_periode))
+    h = harian.reset_index() if harian is not None and len(harian) else pd.DataFrame(columns=['Tanggal', 'Kapster', 'kepala', 'gross', 'disc', 'masuk'])
+    h['net'] = h['gross'] - h['disc']
+    kolom = {}
+    for awal, akhir in daftar_periode:
+        label = f"{awal:%d/%m/%y} – {akhir:%d/%m/%y}"
+        pilih = h[(h['Tanggal'] >= pd.Timestamp(awal)) & (h['Tanggal'] <= pd.Timestamp(akhir))]
+        tabel = pilih.groupby('Kapster', observed=True)[METRIK_ANALITIK].sum().reindex(kapsters, fill_value=0)
+        tabel.loc['Total'] = tabel.sum()
+        k = keluar[(keluar.index >= pd.Timestamp(awal)) & (keluar.index <= pd.Timestamp(akhir))].sum() if keluar is not None and len(keluar) else 0
+        tabel['keluar'] = pd.NA; tabel.loc['Total', 'keluar'] = int(k)
+        tabel['laba'] = pd.NA; tabel.loc['Total', 'laba'] = int(pilih['masuk'].sum()) - int(k)
+        for m in tabel.columns: kolom[(m, label)] = tabel[m]
+    hasil = pd.DataFrame(kolom); hasil.columns.names = ['Metrik', 'Periode']
+    return hasil
+
+# --- CHECKOUT PANE ---
+# Pricing widgets (upgrade, add-ons, discount) rerun only this fragment, against the catalog and
+# discount status fetched by the last full run. Paying or cancelling triggers the full rerun.
+@st.fragment
+def panel_checkout(pilihan, katalog, status_izin):
+    id_bk, label, lay_awal, nam, no_hp, jam_bk, kap, tgl_bk = pilihan
+    st.info(f"🔒 **Layanan Utama:** {lay_awal}")
+
+    st.markdown("#### 🚀 Upgrade Layanan (Opsional)")
+    cek_upgrade = st.checkbox("Pelanggan ganti ke paket lebih mahal?")
+    item_upgrade_diff = None; nama_layanan_final = lay_awal
+
+    if cek_upgrade:
+        opsi_up = list(katalog.daftar_nama)
+        if lay_awal in opsi_up: opsi_up.remove(lay_awal)
+        col_up1, col_up2 = st.columns([2, 1])
+        with col_up1: target_upgrade = st.selectbox("Upgrade menjadi:", opsi_up)
+
+        selisih = katalog.selisih_upgrade(lay_awal, target_upgrade)
+
+        with col_up2:
+            if selisih > 0:
+                st.success(f"➕ Tambah: Rp {selisih:,}")
+                nama_layanan_final = f"{target_upgrade} (Up from {lay_awal})"
+                item_upgrade_diff = {'nama': "Biaya Upgrade Layanan", 'harga': selisih}
+            elif selisih == 0: st.warning("Harga sama.")
+            else: st.error("⛔ Dilarang Downgrade!")
+
+    st.markdown("#### 🧴 Tambahan Lain")
+    opsi_addon = list(katalog.daftar_nama)
+    if lay_awal in opsi_addon: opsi_addon.remove(lay_awal)
+    if cek_upgrade and target_upgrade in opsi_addon: opsi_addon.remove(target_upgrade)
+    layanan_tambahan = st.multiselect("Pilih item tambahan:", opsi_addon)
+
+    list_belanja = []; total_tagihan_normal = 0
+    harga_base = katalog.harga(lay_awal)
+    list_belanja.append({'nama': f"Jasa {nama_layanan_final}", 'harga': harga_base})
+    total_tagihan_normal += harga_base
+    if item_upgrade_diff: list_belanja.append(item_upgrade_diff); total_tagihan_normal += item_upgrade_diff['harga']
+    for tamb in layanan_tambahan:
+        h_tamb = katalog.harga(tamb)
+        list_belanja.append({'nama': f"Add-on {tamb}", 'harga': h_tamb})
+        total_tagihan_normal += h_tamb
+
+    st.write("---")
+    c1, c2, c3 = st.columns([1, 1.5, 1])
+    with c1:
+        st.caption("📢 Info & Reminder:")
+        pesan_wa = (f"Halo Kak *{nam}*, kami mengingatkan booking jam *{jam_bk}* ya. Sampai jumpa! 💈")
+        st.link_button("💬 Chat Reminder", f"https://wa.me/{format_nomor_wa(no_hp)}?text={urllib.parse.quote(pesan_wa)}")
+        st.write("---")
+        st.caption(f"🛒 Rincian ({len(list_belanja)} Item):")
+        for item in list_belanja: st.text(f"- {item['nama']}")
+    with c2:
+        nominal_diskon = 0; total_final = total_tagihan_normal
+
+        if status_izin == 'UNLOCKED':
+            st.markdown("##### 🏷️ Diskon")
+            jenis_disc = st.radio("Tipe", ["Tanpa Diskon", "Rupiah", "Persen"], horizontal=True, label_visibility="collapsed")
+            if jenis_disc == "Rupiah": nominal_diskon = st.number_input("Nominal", min_value=0, step=1000)
+            elif jenis_disc == "Persen": nominal_diskon = total_tagihan_normal * (st.number_input("Persen", 0, 100, 5) / 100)
+        else:
+            st.markdown("##### 🏷️ Diskon"); st.info("🔒 Terkunci"); nominal_diskon = 0
+
+        total_final = max(0, total_tagihan_normal - nominal_diskon)
+        if nominal_diskon > 0:
+            st.caption(f"Normal: {total_tagihan_normal:,} | Disc: -{int(nominal_diskon):,}")
+            st.markdown(f"#### Total: Rp {int(total_final):,}")
+        else: st.metric("Total Tagihan", f"Rp {total_tagihan_normal:,}")
+
+        st.write("---")
+        metode = st.radio("Metode Bayar:", ["Tunai", "QRIS"], horizontal=True)
+        tombol_aman = True
+        if cek_upgrade and selisih < 0: tombol_aman = False
+
+        if tombol_aman and total_final >= 0:
+            if st.button("✅ Bayar & Cetak", type="primary"):
+                nama_simpan = nam
+                if item_upgrade_diff: nama_simpan = f"{nam} [UPGRADE]"
+                no_nota_hasil = proses_pembayaran(id_bk, nama_simpan, list_belanja, metode, kap, int(nominal_diskon), int(total_final))
+                if no_nota_hasil:
+                    img = generate_receipt_image(nam, list_belanja, total_tagihan_normal, int(nominal_diskon), int(total_final), kap, tgl_bk, jam_bk, no_nota_hasil)
+                    st.session_state['nota_terakhir'] = {'img': img, 'nama': nam, 'wa': no_hp, 'items': list_belanja, 'total_normal': total_tagihan_normal, 'diskon': int(nominal_diskon), 'total_final': int(total_final)}
+                    st.rerun()
+        elif not tombol_aman: st.error("Perbaiki pilihan upgrade.")
+    with c3:
+        with st.popover("❌ Batal"):
+            st.write(f"Batalkan {nam}?")
+            alasan_batal = st.text_input("Alasan (Wajib)", placeholder="No Show")
+            if st.button("Ya, Hapus"):
+                if alasan_batal:
+                    if batalkan_booking(id_bk, alasan_batal): st.toast("Dibatalkan!"); time.sleep(1); st.rerun()
+                else: st.error("Isi alasan.")
+
 # --- MAIN UI ---
+# Page sections -> the prefetch tasks that section needs (see the cashier page)
+SEKSI_KASIR = {
+    "🔴 Antrian & Bayar": ['layanan', 'diskon', 'booking'], "✅ Riwayat": ['booking'], "💰 Pengeluaran": ['pengeluaran'],
+    "📊 Lapor Bos": [], "🏆 Mingguan": [], "🧴 Pomade": ['pomade'],
+}
+SEKSI_OWNER = ["🔓 Discount Control", "📅 Monthly Performance", "💸 Owner Expenses", "💵 Profit & Share", "📈 Range & Compare"]
+
 # UI Language: Indonesian
 menu = st.sidebar.selectbox("Pilih Mode Aplikasi", ["Booking Pelanggan", "Halaman Kasir", "Owner Insight"])
 
@@ -500,7 +1609,12 @@ if menu == "Booking Pelanggan":
         st.session_state['last_wa_checked'] = ""     
         st.session_state['sukses_reset'] = False     
     
-    DATA_LAYANAN = get_daftar_layanan()
+    # Service list and the Booking mirror (used by the slot check) load side by side
+    data_awal = jalankan_paralel({
+        'layanan': (get_daftar_layanan, (), KATALOG_DEFAULT),
+        'booking': (get_sheet_mirror('Booking').sinkron, (), None),
+    })
+    DATA_LAYANAN = data_awal['layanan']
     
     list_kapster = ["Kenzo", "Arka"] 
     if 'default_kapster_index' not in st.session_state:
@@ -518,23 +1632,41 @@ if menu == "Booking Pelanggan":
         st.subheader(f"Profil: {kapster}")
         st.info(INFO_KAPSTER[kapster]['deskripsi'])
         st.write("---")
-        layanan_pilihan = st.selectbox("Pilih Layanan", list(DATA_LAYANAN.keys()))
-        detail = DATA_LAYANAN[layanan_pilihan]
+        layanan_pilihan = st.selectbox("Pilih Layanan", DATA_LAYANAN.daftar_nama)
+        detail = DATA_LAYANAN.info(layanan_pilihan)
         st.markdown(f"**⏱️ Durasi:** {detail['Durasi']} Menit") 
         st.caption(f"📝 *Include: {detail['Deskripsi']}*")
 
         hari_ini_wib = (datetime.utcnow() + timedelta(hours=7)).date()
+        with st.expander(f"📅 Ketersediaan {KALENDER_HARI} Hari ke Depan"):
+            try:
+                kalender = get_kalender_tersedia(hari_ini_wib, KALENDER_HARI, list_kapster, detail['Durasi'], DATA_LAYANAN)
+                maks_slot = max(1, len(range(JAM_BUKA_MENIT, JAM_TUTUP_MENIT - int(detail['Durasi']) + 1, SLOT_MENIT)))
+                df_kalender = pd.DataFrame([
+                    {'Tanggal': tanggal_indo(hari_ini_wib + timedelta(days=i)), **{k: len(kalender[(str(hari_ini_wib + timedelta(days=i)), k)]) for k in list_kapster}}
+                    for i in range(KALENDER_HARI)
+                ])
+                st.dataframe(df_kalender, hide_index=True, use_container_width=True, column_config={
+                    k: st.column_config.ProgressColumn(k, format="%d slot", min_value=0, max_value=maks_slot) for k in list_kapster
+                })
+            except Exception as e: print(f"Kalender gagal dimuat: {e}"); st.caption("Kalender belum bisa dimuat.")
         tgl = st.date_input("Tanggal Booking", hari_ini_wib, format="DD/MM/YYYY", key="tgl_booking_unik")
         st.caption(f"📅 Pilihan: **{tanggal_indo(tgl)}**")
                             
         durasi_user = detail['Durasi']
         jam_tersedia = get_jam_tersedia(tgl, kapster, durasi_user, DATA_LAYANAN)
+        # The time chosen on the previous run may have left the list meanwhile; the selectbox would then
+        # silently fall back to its first option, so remember it and refuse instead of booking that
+        pilihan_lama = st.session_state.get('jam_dipilih')
+        jam_diambil = pilihan_lama[3] if pilihan_lama and pilihan_lama[:3] == (tgl, kapster, layanan_pilihan) and pilihan_lama[3] not in jam_tersedia else None
         
         if not jam_tersedia:
             st.warning("⚠️ Jadwal Penuh untuk layanan ini.")
             jam = st.selectbox("Jam", ["Penuh"], disabled=True, key="jam_full_disabled"); tombol_aktif = False
         else:
             jam = st.selectbox("Pilih Jam (Interval 15 Menit)", jam_tersedia, key="jam_booking_unik"); tombol_aktif = True
+        if jam_diambil and not st.session_state.get('tombol_booking'): tolak_jam_hilang(tgl, jam_diambil, kapster, durasi_user)
+        st.session_state['jam_dipilih'] = (tgl, kapster, layanan_pilihan, jam) if jam_tersedia else None
     
     st.write("---") 
     st.subheader("Data Diri Pemesan")
@@ -563,8 +1695,9 @@ if menu == "Booking Pelanggan":
     
     st.write("---")
 
-    if st.button("Booking Sekarang", type="primary", disabled=not tombol_aktif, use_container_width=True):
-        if nama and wa and jam != "Penuh":
+    if st.button("Booking Sekarang", type="primary", disabled=not tombol_aktif, use_container_width=True, key="tombol_booking"):
+        if jam_diambil: tolak_jam_hilang(tgl, jam_diambil, kapster, durasi_user)
+        elif nama and wa and jam != "Penuh":
             with st.spinner("Mendaftarkan Booking..."):
                 sukses_booking = simpan_booking(nama, wa, kapster, layanan_pilihan, tgl, jam)
                 if sukses_booking:
@@ -580,14 +1713,25 @@ if menu == "Booking Pelanggan":
 elif menu == "Halaman Kasir":
     st.title("💼 Dashboard Kasir")
     password = st.sidebar.text_input("Password", type="password")
-    DATA_LAYANAN = get_daftar_layanan() 
 
     if password == "kasirsecrets":
         st.sidebar.success("Login Berhasil")
-        tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["🔴 Antrian & Bayar", "✅ Riwayat", "💰 Pengeluaran", "📊 Lapor Bos", "🏆 Mingguan", "🧴 Pomade"])
+        # Only the selected section runs (st.tabs would execute every tab body on each rerun),
+        # and only that section's sheets are prefetched
+        seksi = st.radio("Menu Kasir", list(SEKSI_KASIR), horizontal=True, key="seksi_kasir", label_visibility="collapsed")
+        pemuat = {
+            'layanan': (get_daftar_layanan, (), KATALOG_DEFAULT),
+            'diskon': (get_diskon_status, (), 'UNLOCKED'),
+            'booking': (get_booking_locator().segarkan, (), None),  # Mirror sync + ID map (read-only)
+            'pengeluaran': (get_sheet_mirror('Pengeluaran').sinkron, (), None),
+            'pomade': (get_rekap_pomade_harian, (), pd.DataFrame()),
+        }
+        data_awal = jalankan_paralel({k: pemuat[k] for k in SEKSI_KASIR[seksi]})
+        DATA_LAYANAN = data_awal.get('layanan', KATALOG_DEFAULT)
+        tab1, tab2, tab3, tab4, tab5, tab6 = list(SEKSI_KASIR)
         
         # TAB 1: CASHIER
-        with tab1:
+        if seksi == tab1:
             if st.session_state['nota_terakhir'] is not None:
                 data_nota = st.session_state['nota_terakhir']
                 st.success("✅ Transaksi Selesai!")
@@ -611,12 +1755,10 @@ elif menu == "Halaman Kasir":
                     st.write("---")
                     if st.button("Tutup / Transaksi Baru"): st.session_state['nota_terakhir'] = None; st.rerun()
             else:
-                if st.button("🔄 Refresh Data Antrian"): st.rerun()
+                if st.button("🔄 Refresh Data Antrian"): get_sheet_mirror('Booking').tandai_append(); st.rerun()
                 st.subheader("📋 Daftar Antrian Booking")
                 try:
-                    sheet = get_google_sheet('Booking')
-                    data = sheet.get_all_records()
-                    df = pd.DataFrame(data)
+                    df = baca_sheet('Booking')
                     if not df.empty:
                         df.columns = df.columns.str.strip()
                         if 'Waktu' in df.columns and 'Jam' not in df.columns: df.rename(columns={'Waktu': 'Jam'}, inplace=True)
@@ -633,105 +1775,11 @@ elif menu == "Halaman Kasir":
                             for i, row in df_pending.iterrows():
                                 tgl_cantik = tanggal_indo(row['Tanggal'])
                                 label = f"{tgl_cantik} | {row['Jam']} - {row['Nama_Pelanggan']} ({row['Kapster']})"
-                                pilihan_list.append((row['index'], label, row['Layanan'], row['Nama_Pelanggan'], row['No_WA'], row['Jam'], row['Kapster'], row['Tanggal']))
+                                id_bk = str(row.get('ID_Booking', '')).strip() or int(row['index']) + 2  # No ID yet: its sheet row (see BookingLocator.cari)
+                                pilihan_list.append((id_bk, label, row['Layanan'], row['Nama_Pelanggan'], row['No_WA'], row['Jam'], row['Kapster'], row['Tanggal']))
                             pilihan = st.selectbox("Pilih Pelanggan:", pilihan_list, format_func=lambda x: x[1])
                             
-                            if pilihan:
-                                idx, label, lay_awal, nam, no_hp, jam_bk, kap, tgl_bk = pilihan
-                                st.info(f"🔒 **Layanan Utama:** {lay_awal}")
-                                
-                                st.markdown("#### 🚀 Upgrade Layanan (Opsional)")
-                                cek_upgrade = st.checkbox("Pelanggan ganti ke paket lebih mahal?")
-                                item_upgrade_diff = None; nama_layanan_final = lay_awal
-                                
-                                if cek_upgrade:
-                                    opsi_up = list(DATA_LAYANAN.keys())
-                                    if lay_awal in opsi_up: opsi_up.remove(lay_awal)
-                                    col_up1, col_up2 = st.columns([2, 1])
-                                    with col_up1: target_upgrade = st.selectbox("Upgrade menjadi:", opsi_up)
-                                    
-                                    harga_awal = 0; harga_akhir = 0
-                                    for db_n, db_v in DATA_LAYANAN.items():
-                                        if str(db_n).strip() == str(lay_awal).strip(): harga_awal = db_v['Harga']; break
-                                    harga_akhir = DATA_LAYANAN[target_upgrade]['Harga']
-                                    selisih = harga_akhir - harga_awal
-                                    
-                                    with col_up2:
-                                        if selisih > 0:
-                                            st.success(f"➕ Tambah: Rp {selisih:,}")
-                                            nama_layanan_final = f"{target_upgrade} (Up from {lay_awal})"
-                                            item_upgrade_diff = {'nama': "Biaya Upgrade Layanan", 'harga': selisih}
-                                        elif selisih == 0: st.warning("Harga sama.")
-                                        else: st.error("⛔ Dilarang Downgrade!")
-
-                                st.markdown("#### 🧴 Tambahan Lain")
-                                opsi_addon = list(DATA_LAYANAN.keys())
-                                if lay_awal in opsi_addon: opsi_addon.remove(lay_awal)
-                                if cek_upgrade and target_upgrade in opsi_addon: opsi_addon.remove(target_upgrade)
-                                layanan_tambahan = st.multiselect("Pilih item tambahan:", opsi_addon)
-                                
-                                list_belanja = []; total_tagihan_normal = 0
-                                harga_base = 0
-                                for db_n, db_v in DATA_LAYANAN.items():
-                                    if str(db_n).strip() == str(lay_awal).strip(): harga_base = db_v['Harga']; break
-                                list_belanja.append({'nama': f"Jasa {nama_layanan_final}", 'harga': harga_base})
-                                total_tagihan_normal += harga_base
-                                if item_upgrade_diff: list_belanja.append(item_upgrade_diff); total_tagihan_normal += item_upgrade_diff['harga']
-                                for tamb in layanan_tambahan:
-                                    h_tamb = DATA_LAYANAN[tamb]['Harga']
-                                    list_belanja.append({'nama': f"Add-on {tamb}", 'harga': h_tamb})
-                                    total_tagihan_normal += h_tamb
-                                
-                                st.write("---")
-                                c1, c2, c3 = st.columns([1, 1.5, 1])
-                                with c1:
-                                    st.caption("📢 Info & Reminder:")
-                                    pesan_wa = (f"Halo Kak *{nam}*, kami mengingatkan booking jam *{jam_bk}* ya. Sampai jumpa! 💈")
-                                    st.link_button("💬 Chat Reminder", f"https://wa.me/{format_nomor_wa(no_hp)}?text={urllib.parse.quote(pesan_wa)}")
-                                    st.write("---")
-                                    st.caption(f"🛒 Rincian ({len(list_belanja)} Item):")
-                                    for item in list_belanja: st.text(f"- {item['nama']}")
-                                with c2:
-                                    status_izin = get_diskon_status()
-                                    nominal_diskon = 0; total_final = total_tagihan_normal
-                                    
-                                    if status_izin == 'UNLOCKED':
-                                        st.markdown("##### 🏷️ Diskon")
-                                        jenis_disc = st.radio("Tipe", ["Tanpa Diskon", "Rupiah", "Persen"], horizontal=True, label_visibility="collapsed")
-                                        if jenis_disc == "Rupiah": nominal_diskon = st.number_input("Nominal", min_value=0, step=1000)
-                                        elif jenis_disc == "Persen": nominal_diskon = total_tagihan_normal * (st.number_input("Persen", 0, 100, 5) / 100)
-                                    else:
-                                        st.markdown("##### 🏷️ Diskon"); st.info("🔒 Terkunci"); nominal_diskon = 0
-                                    
-                                    total_final = max(0, total_tagihan_normal - nominal_diskon)
-                                    if nominal_diskon > 0:
-                                        st.caption(f"Normal: {total_tagihan_normal:,} | Disc: -{int(nominal_diskon):,}")
-                                        st.markdown(f"#### Total: Rp {int(total_final):,}")
-                                    else: st.metric("Total Tagihan", f"Rp {total_tagihan_normal:,}")
-
-                                    st.write("---")
-                                    metode = st.radio("Metode Bayar:", ["Tunai", "QRIS"], horizontal=True)
-                                    tombol_aman = True
-                                    if cek_upgrade and selisih < 0: tombol_aman = False
-                                    
-                                    if tombol_aman and total_final >= 0:
-                                        if st.button("✅ Bayar & Cetak", type="primary"):
-                                            nama_simpan = nam
-                                            if item_upgrade_diff: nama_simpan = f"{nam} [UPGRADE]"
-                                            no_nota_hasil = proses_pembayaran(idx, nama_simpan, list_belanja, metode, kap, int(nominal_diskon), int(total_final))
-                                            if no_nota_hasil:
-                                                img = generate_receipt_image(nam, list_belanja, total_tagihan_normal, int(nominal_diskon), int(total_final), kap, tgl_bk, jam_bk, no_nota_hasil)
-                                                st.session_state['nota_terakhir'] = {'img': img, 'nama': nam, 'wa': no_hp, 'items': list_belanja, 'total_normal': total_tagihan_normal, 'diskon': int(nominal_diskon), 'total_final': int(total_final)}
-                                                st.cache_data.clear(); st.rerun()
-                                    elif not tombol_aman: st.error("Perbaiki pilihan upgrade.")
-                                with c3:
-                                    with st.popover("❌ Batal"):
-                                        st.write(f"Batalkan {nam}?")
-                                        alasan_batal = st.text_input("Alasan (Wajib)", placeholder="No Show")
-                                        if st.button("Ya, Hapus"):
-                                            if alasan_batal:
-                                                if batalkan_booking(idx, alasan_batal): st.toast("Dibatalkan!"); st.cache_data.clear(); time.sleep(1); st.rerun()
-                                            else: st.error("Isi alasan.")
+                            if pilihan: panel_checkout(pilihan, DATA_LAYANAN, data_awal['diskon'])
                         else: st.info("Antrian kosong.")
                     else: st.info("Data kosong.")
                 except Exception as e: st.error(f"Error: {e}")
@@ -756,24 +1804,22 @@ elif menu == "Halaman Kasir":
                     c_go1, c_go2 = st.columns(2)
                     with c_go1:
                         go_kapster = st.selectbox("Pilih Kapster", list(INFO_KAPSTER.keys()), key="go_kapster")
-                        go_layanan = st.selectbox("Pilih Layanan", list(DATA_LAYANAN.keys()), key="go_layanan")
+                        go_layanan = st.selectbox("Pilih Layanan", DATA_LAYANAN.daftar_nama, key="go_layanan")
                     with c_go2:
-                        opsi_go_addon = list(DATA_LAYANAN.keys())
+                        opsi_go_addon = list(DATA_LAYANAN.daftar_nama)
                         if go_layanan in opsi_go_addon: opsi_go_addon.remove(go_layanan)
                         go_addon = st.multiselect("Tambahan", opsi_go_addon, key="go_addon")
                         go_metode = st.radio("Metode Bayar", ["Tunai", "QRIS"], horizontal=True, key="go_metode")
 
                     go_total_normal = 0; go_items = []
-                    hrg_utama = 0
-                    for db_n, db_v in DATA_LAYANAN.items():
-                        if str(db_n).strip() == str(go_layanan).strip(): hrg_utama = db_v['Harga']; break
+                    hrg_utama = DATA_LAYANAN.harga(go_layanan)
                     go_items.append({'nama': f"Jasa {go_layanan}", 'harga': hrg_utama})
                     go_total_normal += hrg_utama
                     for add in go_addon:
-                        h_add = DATA_LAYANAN[add]['Harga']; go_items.append({'nama': f"Add-on {add}", 'harga': h_add}); go_total_normal += h_add
+                        h_add = DATA_LAYANAN.harga(add); go_items.append({'nama': f"Add-on {add}", 'harga': h_add}); go_total_normal += h_add
                     
                     st.write("---")
-                    status_izin_go = get_diskon_status(); go_nominal_diskon = 0
+                    status_izin_go = data_awal['diskon']; go_nominal_diskon = 0
                     if status_izin_go == 'UNLOCKED':
                         c_d1, c_d2 = st.columns([1, 1])
                         with c_d1: go_jenis_disc = st.radio("Diskon", ["Tanpa Diskon", "Rupiah", "Persen"], horizontal=True, key="go_type_disc")
@@ -794,28 +1840,30 @@ elif menu == "Halaman Kasir":
                                 try:
                                     sheet_bk = get_google_sheet('Booking')
                                     waktu_input = now_obj.strftime("%Y-%m-%d %H:%M:%S")
-                                    sheet_bk.append_row([now_obj.strftime("%Y-%m-%d"), now_obj.strftime("%H:%M"), go_nama, format_wa_0(go_wa), go_kapster, go_layanan, "Proses..", waktu_input, ""])
-                                    idx_fungsi = len(sheet_bk.get_all_values()) - 2
-                                    no_nota = proses_pembayaran(idx_fungsi, go_nama, go_items, go_metode, go_kapster, int(go_nominal_diskon), int(go_total_final))
+                                    id_go = buat_id_booking()
+                                    res = sheet_bk.append_row(baris_booking_baru([now_obj.strftime("%Y-%m-%d"), now_obj.strftime("%H:%M"), go_nama, format_wa_0(go_wa), go_kapster, go_layanan, "Proses..", waktu_input, ""], id_go))
+                                    if baris_dari_append(res): get_booking_locator().catat(id_go, baris_dari_append(res))
+                                    tandai_sheet_berubah('Booking')
+                                    no_nota = proses_pembayaran(id_go, go_nama, go_items, go_metode, go_kapster, int(go_nominal_diskon), int(go_total_final))
                                     if no_nota:
                                         img = generate_receipt_image(go_nama, go_items, go_total_normal, int(go_nominal_diskon), int(go_total_final), go_kapster, now_obj.strftime("%Y-%m-%d"), now_obj.strftime("%H:%M"), no_nota)
                                         st.session_state['reset_go_show'] = True
                                         st.session_state['nota_terakhir'] = {'img': img, 'nama': go_nama, 'wa': go_wa, 'items': go_items, 'total_normal': go_total_normal, 'diskon': int(go_nominal_diskon), 'total_final': int(go_total_final)}
-                                        st.cache_data.clear(); st.rerun()
+                                        st.rerun()
                                 except Exception as e: st.error(f"Gagal: {e}")
                         else: st.warning("Nama dan WA wajib diisi.")
 
         # TAB 2
-        with tab2:
+        elif seksi == tab2:
             st.header("✅ Riwayat & Cetak Ulang")
             try:
-                sheet = get_google_sheet('Booking'); data = sheet.get_all_records(); df = pd.DataFrame(data)
+                df = baca_bertipe('Booking')
                 if not df.empty:
                     if 'Waktu' in df.columns: df.rename(columns={'Waktu': 'Jam'}, inplace=True)
                     if 'Jam' in df.columns:
                         col_tgl1, col_tgl2 = st.columns([1, 2])
-                        with col_tgl1: tgl_filter = st.date_input("Pilih Tanggal", datetime.now())
-                        df_filtered = df[df['Tanggal'].astype(str) == str(tgl_filter)].copy()
+                        with col_tgl1: tgl_filter = st.date_input("Pilih Tanggal", datetime.now(), key="tgl_riwayat")
+                        df_filtered = df[df['Tanggal'] == pd.Timestamp(tgl_filter)].copy()
                         if not df_filtered.empty:
                             df_filtered = df_filtered.sort_values(by='Jam', ascending=False)
                             if 'No_WA' in df_filtered.columns: df_filtered['No_WA'] = df_filtered['No_WA'].apply(format_wa_0)
@@ -839,12 +1887,11 @@ elif menu == "Halaman Kasir":
                                         items = []; total = 0
                                         with st.spinner("Mengambil data..."):
                                             try:
-                                                sheet_uang = get_google_sheet('Pemasukan'); df_uang = pd.DataFrame(sheet_uang.get_all_records())
+                                                df_uang = baca_pemasukan()
                                                 if not df_uang.empty:
-                                                    df_match = df_uang[df_uang['Keterangan'].str.contains(f"[{no_nota}]", regex=False, na=False)]
-                                                    for _, r in df_match.iterrows():
-                                                        nom = int(str(r['Nominal']).replace('.','').replace(',',''))
-                                                        items.append({'nama': r['Item'], 'harga': nom}); total += nom
+                                                    df_match = df_uang[df_uang['Nota_ID'] == no_nota]
+                                                    for item, nom in zip(df_match['Item'], df_match['Nominal']):
+                                                        items.append({'nama': item, 'harga': int(nom)}); total += int(nom)
                                             except: pass
                                         if not items: items = [{'nama': f"Jasa {d_row['Layanan']}", 'harga': 0}]; st.warning("Data default.")
                                         img = generate_receipt_image(d_row['Nama_Pelanggan'], items, total, 0, total, d_row['Kapster'], str(tgl_filter), str(d_row['Jam']), no_nota)
@@ -857,11 +1904,11 @@ elif menu == "Halaman Kasir":
             except Exception as e: st.error(f"Error: {e}")
 
         # TAB 3
-        with tab3:
+        elif seksi == tab3:
             st.header("💰 Catat Pengeluaran")
             list_rek = ["Laundry Handuk", "Token Listrik"]
             try:
-                sheet_out = get_google_sheet('Pengeluaran'); df_out = pd.DataFrame(sheet_out.get_all_records())
+                df_out = baca_sheet('Pengeluaran')
                 if not df_out.empty and 'Item' in df_out.columns:
                     list_rek = sorted(list(set(list_rek + df_out['Item'].unique().tolist())))
             except: pass 
@@ -873,11 +1920,11 @@ elif menu == "Halaman Kasir":
             st.write("---")
             if st.button("Simpan Pengeluaran", type="primary"):
                 if nama_final and nom > 0:
-                    if simpan_pengeluaran(nama_final, ket, nom): st.success("✅ Disimpan!"); st.cache_data.clear(); time.sleep(1.5); st.rerun()
+                    if simpan_pengeluaran(nama_final, ket, nom): st.success("✅ Disimpan!"); time.sleep(1.5); st.rerun()
                 else: st.warning("Isi data lengkap.")
 
         # TAB 4
-        with tab4:
+        elif seksi == tab4:
             st.header("📊 Laporan Harian")
             st.caption("Pilih tanggal, cek data, lalu kirim rekap lengkap ke WA.")
             now_wib = datetime.utcnow() + timedelta(hours=7)
@@ -888,36 +1935,30 @@ elif menu == "Halaman Kasir":
             if st.button(f"Hitung Rekap Tanggal {tanggal_indo(tgl_laporan)}"):
                 try:
                     df_masuk = pd.DataFrame(); df_keluar = pd.DataFrame(); df_bk = pd.DataFrame()
+                    baca_batch(['Pemasukan', 'Pengeluaran', 'Booking'])  # One round trip; the typed readers below reuse the fresh mirrors
+                    tgl_ts = pd.Timestamp(tgl_str)
                     try:
-                        sheet_in = get_google_sheet('Pemasukan'); df_in = pd.DataFrame(sheet_in.get_all_records())
-                        if not df_in.empty: df_in['Tanggal'] = df_in['Tanggal'].astype(str); df_masuk = df_in[df_in['Tanggal'] == tgl_str]
+                        df_in = baca_pemasukan()
+                        if not df_in.empty: df_masuk = df_in[df_in['Tanggal'] == tgl_ts]
                     except: pass
                     try:
-                        sheet_out = get_google_sheet('Pengeluaran'); df_out = pd.DataFrame(sheet_out.get_all_records())
-                        if not df_out.empty: df_out['Tanggal'] = df_out['Tanggal'].astype(str); df_keluar = df_out[df_out['Tanggal'] == tgl_str]
+                        df_out = baca_bertipe('Pengeluaran')
+                        if not df_out.empty: df_keluar = df_out[df_out['Tanggal'] == tgl_ts]
                     except: pass
                     try:
-                        sheet_b = get_google_sheet('Booking'); df_b = pd.DataFrame(sheet_b.get_all_records())
-                        if not df_b.empty: df_b['Tanggal'] = df_b['Tanggal'].astype(str); df_bk = df_b[(df_b['Tanggal'] == tgl_str) & (df_b['Status'] == 'Selesai')]
+                        df_b = baca_bertipe('Booking')
+                        if not df_b.empty: df_bk = df_b[(df_b['Tanggal'] == tgl_ts) & (df_b['Status'] == 'Selesai')]
                     except: pass
 
-                    tot_masuk = df_masuk['Nominal'].sum() if not df_masuk.empty else 0
-                    tot_keluar = df_keluar['Nominal'].sum() if not df_keluar.empty else 0
-                    tot_cash = 0; count_cash = 0; tot_qris = 0; count_qris = 0
-                    
-                    if not df_masuk.empty:
-                        mask_c = df_masuk['Keterangan'].str.contains("Tunai", case=False, na=False)
-                        tot_cash = df_masuk[mask_c]['Nominal'].sum(); count_cash = len(df_masuk[mask_c])
-                        mask_q = df_masuk['Keterangan'].str.contains("QRIS", case=False, na=False)
-                        tot_qris = df_masuk[mask_q]['Nominal'].sum(); count_qris = len(df_masuk[mask_q])
+                    # Totals come from the daily rollup; the two tables below still list the day's rows
+                    harian, _, keluar = get_ringkasan_harian().periode(tgl_ts, tgl_ts)
+                    h = harian.sum() if harian is not None and len(harian) else pd.Series(0, index=KOLOM_HARIAN)
+                    tot_masuk = int(h['masuk']); tot_keluar = int(keluar.sum()) if keluar is not None else 0
+                    tot_cash = int(h['tunai']); count_cash = int(h['n_tunai']); tot_qris = int(h['qris']); count_qris = int(h['n_qris'])
                     
                     # HITUNG DISKON HARI INI
                     tot_disc = 0
-                    if not df_bk.empty and 'Diskon' in df_bk.columns:
-                        def clean(x):
-                            try: return int(str(x).replace('.','').replace(',','').replace('Rp','').strip())
-                            except: return 0
-                        tot_disc = df_bk['Diskon'].apply(clean).sum()
+                    if not df_bk.empty and 'Diskon' in df_bk.columns: tot_disc = df_bk['Diskon'].sum()
 
                     net_cash = tot_cash - tot_keluar
                     c1,c2,c3,c4 = st.columns(4)
@@ -939,8 +1980,8 @@ elif menu == "Halaman Kasir":
 
                     txt_kap = ""; txt_lay = ""
                     if not df_bk.empty:
-                        for k, v in df_bk['Kapster'].value_counts().items(): txt_kap += f"✂️ {k}: {v}\n"
-                        for k, v in df_bk['Layanan'].value_counts().items(): txt_lay += f"💈 {k}: {v}\n"
+                        for k, v in df_bk['Kapster'].astype(str).value_counts().items(): txt_kap += f"✂️ {k}: {v}\n"
+                        for k, v in df_bk['Layanan'].astype(str).value_counts().items(): txt_lay += f"💈 {k}: {v}\n"
                     
                     txt_out = ""
                     if not df_keluar.empty:
@@ -954,73 +1995,19 @@ elif menu == "Halaman Kasir":
                 except Exception as e: st.error(f"Error: {e}")
 
         # TAB 5
-        with tab5:
+        elif seksi == tab5:
             st.header("🏆 Laporan Mingguan")
-            tgl_pilih = st.date_input("Pilih Tanggal", datetime.now())
+            tgl_pilih = st.date_input("Pilih Tanggal", datetime.now(), key="tgl_mingguan")
             start_week = tgl_pilih - timedelta(days=tgl_pilih.weekday())
             end_week = start_week + timedelta(days=6)
             st.info(f"Periode: **{tanggal_indo(start_week)} - {tanggal_indo(end_week)}**")
             
             if st.button("Analisis"):
                 try:
-                    sheet_in = get_google_sheet('Pemasukan'); df_in = pd.DataFrame(sheet_in.get_all_records())
-                    if not df_in.empty:
-                        df_in['Tanggal'] = pd.to_datetime(df_in['Tanggal']).dt.date
-                        df_in = df_in[(df_in['Tanggal'] >= start_week) & (df_in['Tanggal'] <= end_week)]
-                        def clean(x): 
-                            try: return int(str(x).replace('.','').replace(',','').replace('Rp','').strip())
-                            except: return 0
-                        df_in['Nominal'] = df_in['Nominal'].apply(clean)
-
-                        kapsters = list(INFO_KAPSTER.keys())
-                        laporan = {}; t_gross = 0; t_disc = 0; t_net = 0; t_kepala = 0
-
-                        for k in kapsters:
-                            df_k = df_in[df_in['Keterangan'].str.contains(f"- {k}", case=False, na=False)].copy()
-                            if df_k.empty: 
-                                laporan[k] = {'kepala':0, 'gross':0, 'disc':0, 'net':0, 'details':[]}
-                                continue
-                            
-                            df_k['Nota_ID'] = df_k['Keterangan'].str.extract(r'\[(\w+)\]')
-                            grouped = df_k.groupby('Nota_ID')
-                            stats_menu = {}; k_gross = 0; k_disc = 0; k_net = 0; count_kepala = 0
-
-                            for nota, group in grouped:
-                                count_kepala += 1
-                                items_pos = group[group['Nominal'] > 0].to_dict('records')
-                                items_neg = group[group['Nominal'] < 0]['Nominal'].sum()
-                                
-                                # Logic Merge Upgrade
-                                tot_upg = sum([x['Nominal'] for x in items_pos if "biaya upgrade" in str(x['Item']).lower()])
-                                target_idx = -1
-                                for i, item in enumerate(items_pos):
-                                    if "up from" in str(item['Item']).lower(): target_idx = i; break
-                                
-                                final_items = []
-                                if target_idx != -1 and tot_upg > 0:
-                                    for i, item in enumerate(items_pos):
-                                        if i == target_idx:
-                                            new_nom = item['Nominal'] + tot_upg
-                                            new_name = item['Item'].split(' (Up from')[0].strip()
-                                            final_items.append({'Item': new_name, 'Nominal': new_nom})
-                                        elif "biaya upgrade" in str(item['Item']).lower(): continue
-                                        else: final_items.append(item)
-                                else: final_items = items_pos
-
-                                nota_gross = 0
-                                for f in final_items:
-                                    nm = f['Item']; nom = f['Nominal']; nota_gross += nom
-                                    if nm not in stats_menu: stats_menu[nm] = {'qty': 0, 'gross': 0}
-                                    stats_menu[nm]['qty'] += 1; stats_menu[nm]['gross'] += nom
-                                
-                                k_gross += nota_gross; k_disc += abs(items_neg); k_net += (nota_gross - abs(items_neg))
-
-                            detail_list = []
-                            for m, s in stats_menu.items(): detail_list.append({'Menu': m, 'Qty': s['qty'], 'Gross': s['gross']})
-                            if k_disc > 0: detail_list.append({'Menu': '🔻 Diskon', 'Qty': df_k[df_k['Nominal'] < 0].shape[0], 'Gross': -k_disc})
-
-                            laporan[k] = {'kepala': count_kepala, 'gross': k_gross, 'disc': k_disc, 'net': k_net, 'details': detail_list}
-                            t_gross += k_gross; t_disc += k_disc; t_net += k_net; t_kepala += count_kepala
+                    kapsters = list(INFO_KAPSTER.keys())
+                    laporan, total = laporan_periode('mingguan', start_week, end_week, lambda: hitung_laporan_kapster(start_week, end_week, kapsters, '🔻 Diskon'))
+                    if any(total.values()):  # Gate on the report itself: a cached period is served before the mirror loads
+                        t_gross = total['gross']; t_disc = total['disc']; t_net = total['net']; t_kepala = total['kepala']
 
                         st.write("---")
                         c1,c2,c3,c4 = st.columns(4)
@@ -1055,7 +2042,7 @@ elif menu == "Halaman Kasir":
                 except Exception as e: st.error(f"Error: {e}")
 
         # TAB 6
-        with tab6:
+        elif seksi == tab6:
             st.header("📸 Product Sales")
             col_input, col_rekap = st.columns([1, 1])
             with col_input:
@@ -1082,8 +2069,8 @@ elif menu == "Halaman Kasir":
                                 else: st.error("Upload Failed.")
             with col_rekap:
                 st.subheader("📊 Daily Recap")
-                if st.button("🔄 Refresh Data"): st.rerun()
-                df_pomade = get_rekap_pomade_harian()
+                if st.button("🔄 Refresh Data"): get_sheet_mirror('Pomade').tandai_append(); st.rerun()
+                df_pomade = data_awal['pomade']
                 if not df_pomade.empty:
                     st.metric("Total Today", f"Rp {df_pomade['Nominal'].sum():,}")
                     st.dataframe(df_pomade, hide_index=True, use_container_width=True)
@@ -1100,23 +2087,26 @@ elif menu == "Owner Insight":
     
     if pass_owner == "BERKAT2026":
         st.sidebar.success("Access Granted ✅")
+        with st.sidebar.expander("📦 Cache Stats"):
+            st.dataframe(get_cache_registry().statistik(), hide_index=True, use_container_width=True)
         
+        seksi = st.radio("Owner Menu", list(SEKSI_OWNER), horizontal=True, key="seksi_owner", label_visibility="collapsed")
+        t0, t1, t2, t3, t4 = list(SEKSI_OWNER)
+
         # --- DISCOUNT CONTROL ---
-        with st.container(border=True):
-            c1, c2 = st.columns([1, 3])
-            curr = get_diskon_status(); is_unlock = (curr == 'UNLOCKED')
-            with c1: mode = st.toggle("Unlock Discount?", value=is_unlock)
-            with c2:
-                new_s = 'UNLOCKED' if mode else 'LOCKED'
-                if new_s != curr: set_diskon_status(new_s); st.rerun()
-                if mode: st.success("✅ Cashier CAN Discount")
-                else: st.error("🔒 Discount LOCKED")
-
-        DATA_LAYANAN = get_daftar_layanan() 
-        t1, t2, t3 = st.tabs(["📅 Monthly Performance", "💸 Owner Expenses", "💵 Profit & Share"])
-        
+        if seksi == t0:
+            with st.container(border=True):
+                c1, c2 = st.columns([1, 3])
+                curr = get_diskon_status(); is_unlock = (curr == 'UNLOCKED')
+                with c1: mode = st.toggle("Unlock Discount?", value=is_unlock)
+                with c2:
+                    new_s = 'UNLOCKED' if mode else 'LOCKED'
+                    if new_s != curr: set_diskon_status(new_s); st.rerun()
+                    if mode: st.success("✅ Cashier CAN Discount")
+                    else: st.error("🔒 Discount LOCKED")
+
         # --- OWNER TAB 1: MONTHLY ---
-        with t1:
+        elif seksi == t1:
             st.header("Monthly Analysis")
             c_b1, c_b2 = st.columns(2)
             with c_b1: bln = st.selectbox("Select Month", range(1, 13), index=datetime.now().month - 1)
@@ -1124,64 +2114,12 @@ elif menu == "Owner Insight":
             
             if st.button("Show"):
                 try:
-                    sheet_in = get_google_sheet('Pemasukan'); df_in = pd.DataFrame(sheet_in.get_all_records())
-                    if not df_in.empty:
-                        df_in['Tanggal'] = pd.to_datetime(df_in['Tanggal'])
-                        df_in = df_in[(df_in['Tanggal'].dt.month == bln) & (df_in['Tanggal'].dt.year == thn)]
-                        def clean(x): 
-                            try: return int(str(x).replace('.','').replace(',','').replace('Rp','').strip())
-                            except: return 0
-                        df_in['Nominal'] = df_in['Nominal'].apply(clean)
-
-                        kapsters = list(INFO_KAPSTER.keys())
-                        laporan = {}; t_gross = 0; t_disc = 0; t_net = 0; t_kepala = 0
-
-                        for k in kapsters:
-                            df_k = df_in[df_in['Keterangan'].str.contains(f"- {k}", case=False, na=False)].copy()
-                            if df_k.empty: 
-                                laporan[k] = {'kepala':0, 'gross':0, 'disc':0, 'net':0, 'details':[]}
-                                continue
-                            
-                            df_k['Nota_ID'] = df_k['Keterangan'].str.extract(r'\[(\w+)\]')
-                            grouped = df_k.groupby('Nota_ID')
-                            stats_menu = {}; k_gross = 0; k_disc = 0; k_net = 0; count_kepala = 0
-
-                            for nota, group in grouped:
-                                count_kepala += 1
-                                items_pos = group[group['Nominal'] > 0].to_dict('records')
-                                items_neg = group[group['Nominal'] < 0]['Nominal'].sum()
-                                
-                                # Logic Merge Upgrade
-                                tot_upg = sum([x['Nominal'] for x in items_pos if "biaya upgrade" in str(x['Item']).lower()])
-                                target_idx = -1
-                                for i, item in enumerate(items_pos):
-                                    if "up from" in str(item['Item']).lower(): target_idx = i; break
-                                
-                                final_items = []
-                                if target_idx != -1 and tot_upg > 0:
-                                    for i, item in enumerate(items_pos):
-                                        if i == target_idx:
-                                            new_nom = item['Nominal'] + tot_upg
-                                            new_name = item['Item'].split(' (Up from')[0].strip()
-                                            final_items.append({'Item': new_name, 'Nominal': new_nom})
-                                        elif "biaya upgrade" in str(item['Item']).lower(): continue
-                                        else: final_items.append(item)
-                                else: final_items = items_pos
-
-                                nota_gross = 0
-                                for f in final_items:
-                                    nm = f['Item']; nom = f['Nominal']; nota_gross += nom
-                                    if nm not in stats_menu: stats_menu[nm] = {'qty': 0, 'gross': 0}
-                                    stats_menu[nm]['qty'] += 1; stats_menu[nm]['gross'] += nom
-                                
-                                k_gross += nota_gross; k_disc += abs(items_neg); k_net += (nota_gross - abs(items_neg))
-
-                            detail_list = []
-                            for m, s in stats_menu.items(): detail_list.append({'Menu': m, 'Qty': s['qty'], 'Gross': s['gross']})
-                            if k_disc > 0: detail_list.append({'Menu': '🔻 Discount', 'Qty': df_k[df_k['Nominal'] < 0].shape[0], 'Gross': -k_disc})
-
-                            laporan[k] = {'kepala': count_kepala, 'gross': k_gross, 'disc': k_disc, 'net': k_net, 'details': detail_list}
-                            t_gross += k_gross; t_disc += k_disc; t_net += k_net; t_kepala += count_kepala
+                    awal_bulan = date(int(thn), bln, 1)
+                    akhir_bulan = (awal_bulan + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+                    kapsters = list(INFO_KAPSTER.keys())
+                    laporan, total = laporan_periode('bulanan', awal_bulan, akhir_bulan, lambda: hitung_laporan_kapster(awal_bulan, akhir_bulan, kapsters, '🔻 Discount'))
+                    if any(total.values()):  # Gate on the report itself: a cached period is served before the mirror loads
+                        t_gross = total['gross']; t_disc = total['disc']; t_net = total['net']; t_kepala = total['kepala']
                         
                         st.write("---")
                         c1,c2,c3,c4 = st.columns(4)
@@ -1207,12 +2145,13 @@ elif menu == "Owner Insight":
                         # CHART
                         st.subheader("📊 Monthly Chart")
                         chart_df = pd.DataFrame({'Kapster': kapsters, 'Total Heads': [laporan[k]['kepala'] for k in kapsters]})
+                        import altair as alt
                         st.altair_chart(alt.Chart(chart_df).mark_bar().encode(x='Kapster', y='Total Heads'), use_container_width=True)
                     else: st.warning("Data Empty")
                 except Exception as e: st.error(f"Error: {e}")
 
         # --- OWNER TAB 2: EXPENSES ---
-        with t2:
+        elif seksi == t2:
             st.header("💰 Owner Expenses")
             list_rek = ["Gaji Kapster", "Sewa Ruko", "Belanja Logistik", "Maintenance"]
             pilih = st.selectbox("Expense Name", list_rek + ["New Input..."])
@@ -1226,7 +2165,7 @@ elif menu == "Owner Insight":
                         st.success("Saved!"); time.sleep(1); st.rerun()
 
         # --- OWNER TAB 3: PROFIT ---
-        with t3:
+        elif seksi == t3:
             st.header("💵 Profit & Share")
             c1, c2 = st.columns(2)
             with c1: bln_p = st.selectbox("Profit Month", range(1, 13), index=datetime.now().month - 1, key="prof_b")
@@ -1236,26 +2175,12 @@ elif menu == "Owner Insight":
                 try:
                     # 1. OMSET (DARI PEMASUKAN)
                     rev = 0; disc = 0
-                    sheet_in = get_google_sheet('Pemasukan'); df_in = pd.DataFrame(sheet_in.get_all_records())
-                    if not df_in.empty:
-                        df_in['Tanggal'] = pd.to_datetime(df_in['Tanggal'])
-                        df_rev = df_in[(df_in['Tanggal'].dt.month == bln_p) & (df_in['Tanggal'].dt.year == thn_p)]
-                        
-                        def clean(x): 
-                            try: return int(str(x).replace('.','').replace(',','').replace('Rp','').strip())
-                            except: return 0
-                        df_rev['Nominal'] = df_rev['Nominal'].apply(clean)
-                        
-                        rev = df_rev[df_rev['Nominal'] > 0]['Nominal'].sum()
-                        disc = abs(df_rev[df_rev['Nominal'] < 0]['Nominal'].sum())
+                    awal_p = date(int(thn_p), bln_p, 1); akhir_p = (awal_p + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+                    profit = laporan_periode('profit', awal_p, akhir_p, lambda: hitung_profit(awal_p, akhir_p))
+                    rev = profit['rev']; disc = profit['disc']
 
                     # 2. EXPENSE
-                    exp = 0
-                    sheet_out = get_google_sheet('Pengeluaran'); df_out = pd.DataFrame(sheet_out.get_all_records())
-                    if not df_out.empty:
-                        df_out['Tanggal'] = pd.to_datetime(df_out['Tanggal'])
-                        df_exp = df_out[(df_out['Tanggal'].dt.month == bln_p) & (df_out['Tanggal'].dt.year == thn_p)]
-                        if not df_exp.empty: exp = df_exp['Nominal'].apply(clean).sum()
+                    exp = profit['exp']
 
                     # 3. RESULT
                     net_rev = rev - disc 
@@ -1280,4 +2205,36 @@ elif menu == "Owner Insight":
 
                 except Exception as e: st.error(f"Error: {e}")
 
+        # --- OWNER TAB 4: RANGE & COMPARE ---
+        elif seksi == t4:
+            st.header("📈 Range & Compare")
+            hari_ini = (datetime.utcnow() + timedelta(hours=7)).date()
+            c1, c2, c3 = st.columns([2, 2, 1])
+            with c1: rentang = st.date_input("Date Range", (hari_ini.replace(day=1), hari_ini), key="rng_tgl")
+            with c2: gran = st.radio("Granularity", list(GRANULARITAS), horizontal=True, key="rng_gran")
+            label_metrik = {'kepala': 'Heads', 'gross': 'Gross', 'disc': 'Discount', 'net': 'Net', 'keluar': 'Expenses', 'laba': 'Profit'}
+            with c3: metrik = st.selectbox("Metric", ['net', 'gross', 'disc', 'kepala'], format_func=label_metrik.get, key="rng_metrik")
+            banding = st.checkbox("Compare with the previous period of the same length", value=True, key="rng_banding")
+
+            if st.button("Analyze") and len(rentang) == 2:
+                try:
+                    awal_r, akhir_r = rentang
+                    per_kapster, toko = seri_analitik(awal_r, akhir_r, gran)
+                    st.line_chart(per_kapster[metrik].unstack('Kapster'))
+                    df_toko = toko[list(label_metrik)].rename(columns=label_metrik)
+                    df_toko.index = df_toko.index.strftime('%d/%m/%Y')
+                    st.dataframe(df_toko.map(lambda x: f"{int(x):,}".replace(',', '.')), use_container_width=True)
+
+                    if banding:
+                        panjang = akhir_r - awal_r
+                        daftar = [(awal_r - panjang - timedelta(days=1), awal_r - timedelta(days=1)), (awal_r, akhir_r)]
+                        hasil = bandingkan_periode(daftar)
+                        st.subheader("⚖️ Period Comparison")
+                        sebelum, sesudah = hasil.columns.get_level_values('Periode').unique()
+                        ubah = (hasil.xs(sesudah, axis=1, level='Periode') - hasil.xs(sebelum, axis=1, level='Periode'))
+                        hasil = pd.concat([hasil, pd.concat({'Δ': ubah}, axis=1).swaplevel(axis=1)], axis=1)
+                        hasil = hasil[[(m, p) for m in ubah.columns for p in (sebelum, sesudah, 'Δ')]].rename(columns=label_metrik, level='Metrik')
+                        st.dataframe(hasil.map(lambda x: '' if pd.isna(x) else f"{int(x):,}".replace(',', '.')), use_container_width=True)
+                except Exception as e: st.error(f"Error: {e}")
+
     elif pass_owner: st.error("Wrong Password!")